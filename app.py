@@ -1,11 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import time
+_startup_started = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, stream_template, g
+from flask import before_render_template, template_rendered, has_request_context
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from markupsafe import Markup
+from functools import wraps
+import click
+from contextlib import contextmanager
 import json
 import os
-import boto3
+import posixpath
+from urllib.parse import quote
+import sqlite3
 from botocore.exceptions import ClientError
 from decimal import Decimal
+from collections import OrderedDict, Counter, defaultdict
+from collections.abc import Mapping, Sequence
+from array import array
 import logging
-from datetime import datetime
+import threading
+import queue
+import atexit
+import re
+import math
+import bisect
+import heapq
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import base64
+import hashlib
+import hmac
+import uuid
+import secrets
+from datetime import datetime, timezone
+
+from catalog_format import MISSING_YEAR, CompactCatalog, is_compact_catalog
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_change_in_production'
@@ -18,24 +49,313 @@ logger = logging.getLogger(__name__)
 AWS_REGION = 'ap-south-1'
 SNS_TOPIC_ARN = 'arn:aws:sns:ap-south-1:686255965861:bookbazartopic'
 
-# Initialize AWS clients
-try:
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
-    sns = boto3.client('sns', region_name=AWS_REGION)
-    
-    # Get table references
-    users_table = dynamodb.Table('users')
-    carts_table = dynamodb.Table('carts')
-    
-    logger.info("AWS services initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing AWS services: {e}")
-    raise
+# Storage configuration: 'dynamodb' or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'dynamodb')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join('data', 'bookbazar.db'))
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5'))
+
+# Session configuration: 'cookie' (signed cookie), 'memory' (single process) or 'sqlite' (shared disk)
+SESSION_STORE = os.environ.get('SESSION_STORE', 'cookie')
+SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH', SQLITE_PATH)
+SESSION_TTL = float(os.environ.get('SESSION_TTL', '86400'))  # idle lifetime of a server-side session
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '100000'))
+SESSION_LOCAL_CACHE_TTL = float(os.environ.get('SESSION_LOCAL_CACHE_TTL', '5'))  # sqlite store's per-process cache
+SESSION_CART_SUMMARY_TTL = float(os.environ.get('SESSION_CART_SUMMARY_TTL', '30'))
+SESSION_ID_RE = re.compile(r'[A-Za-z0-9_-]{32,64}')
+
+# AWS connection tuning (size the pool to at least the worker thread count)
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_TCP_KEEPALIVE = os.environ.get('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '5'))
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+class AWSClients:
+    """Creates boto3 clients and resources on first use, once per process"""
+
+    def __init__(self, region_name=AWS_REGION):
+        self.region_name = region_name
+        self._lock = threading.RLock()
+        self._pid = None
+        self._session = None
+        self._objects = {}
+
+    def _config(self):
+        from botocore.config import Config
+        return Config(
+            max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+            tcp_keepalive=AWS_TCP_KEEPALIVE,
+            connect_timeout=AWS_CONNECT_TIMEOUT,
+            read_timeout=AWS_READ_TIMEOUT,
+            retries={'max_attempts': AWS_MAX_ATTEMPTS, 'mode': 'standard'}
+        )
+
+    def _ensure_process(self):
+        """Start a fresh boto3 session in a new process; callers hold the lock"""
+        if self._pid != os.getpid():
+            # Clients and their connection pools must not be shared across a fork
+            import boto3
+            self._session = boto3.session.Session(region_name=self.region_name)
+            self._objects = {}
+            self._pid = os.getpid()
+
+    def _get(self, key, factory):
+        obj = self._objects.get(key) if self._pid == os.getpid() else None
+        if obj is not None:
+            return obj
+        with self._lock:
+            self._ensure_process()
+            obj = self._objects.get(key)
+            if obj is None:
+                started = time.perf_counter()
+                obj = factory()
+                self._objects[key] = obj
+                logger.info(f"AWS {key[0]} {key[1]} initialized in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return obj
+
+    def client(self, service_name):
+        """Return the boto3 client for a service"""
+        return self._get(('client', service_name),
+                         lambda: self._session.client(service_name, config=self._config()))
+
+    def resource(self, service_name):
+        """Return the boto3 resource for a service"""
+        return self._get(('resource', service_name),
+                         lambda: self._session.resource(service_name, config=self._config()))
+
+    def table(self, table_name):
+        """Return a DynamoDB Table resource"""
+        return self._get(('table', table_name), lambda: self.resource('dynamodb').Table(table_name))
+
+    def set_client(self, service_name, client):
+        """Use a preconfigured client (e.g. a local stand-in) for a service in this process"""
+        with self._lock:
+            self._ensure_process()
+            self._objects[('client', service_name)] = client
+
+aws = AWSClients()
+
+# Catalog configuration
+# books.json, or a file compiled by tools/compile_catalog.py
+BOOKS_PATH = os.environ.get('BOOKS_PATH', os.path.join('data', 'books.json'))
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', '1.0'))
+
+# Cover images: tools/build_images.py writes content-hashed files and their manifest under static/build
+IMAGE_MANIFEST_PATH = os.environ.get('IMAGE_MANIFEST_PATH', os.path.join('static', 'build', 'manifest.json'))
+HASHED_ASSET_PREFIX = 'build/'  # static files whose names change with their content
+HASHED_ASSET_MAX_AGE = int(os.environ.get('HASHED_ASSET_MAX_AGE', str(365 * 24 * 3600)))
+
+# Cart cache configuration
+CART_CACHE_TTL = float(os.environ.get('CART_CACHE_TTL', '30'))
+CART_CACHE_SIZE = int(os.environ.get('CART_CACHE_SIZE', '10000'))
+
+# Cart lines are stored as one numeric attribute per book on the cart item
+CART_LINE_PREFIX = 'book_'
+
+# Notification dispatcher configuration
+NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', '2'))
+NOTIFY_QUEUE_SIZE = int(os.environ.get('NOTIFY_QUEUE_SIZE', '1000'))
+NOTIFY_DEBOUNCE_SECONDS = float(os.environ.get('NOTIFY_DEBOUNCE_SECONDS', '5'))
+NOTIFY_OVERFLOW_POLICY = os.environ.get('NOTIFY_OVERFLOW_POLICY', 'drop_oldest')  # drop_oldest, drop_newest or block
+NOTIFY_BLOCK_TIMEOUT = float(os.environ.get('NOTIFY_BLOCK_TIMEOUT', '0.5'))
+# Attach a JSON 'payload' message attribute for machine consumers alongside the text message
+NOTIFY_MESSAGE_ATTRIBUTES = os.environ.get('NOTIFY_MESSAGE_ATTRIBUTES', 'true').lower() == 'true'
+
+# Order confirmation outbox configuration
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_DELAY = float(os.environ.get('OUTBOX_RETRY_DELAY', '1'))  # doubled after each failed attempt
+OUTBOX_SWEEP_INTERVAL = float(os.environ.get('OUTBOX_SWEEP_INTERVAL', '60'))  # 0 disables the sweep
+# Sparse GSI on the orders table: partition key outbox_pending (N), sort key created_at (S), keys only.
+# Only orders awaiting their confirmation carry outbox_pending, so the sweep reads just those.
+ORDERS_OUTBOX_INDEX = os.environ.get('ORDERS_OUTBOX_INDEX', 'outbox-pending-index')
+
+# Checkout idempotency keys double as order ids
+IDEMPOTENCY_KEY_RE = re.compile(r'[A-Za-z0-9_-]{8,64}')
+
+# Password hashing configuration (hashes record their parameters, so these can be raised at any time)
+PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt')  # scrypt or pbkdf2_sha256
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', '16384'))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', '600000'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', str(4 * PASSWORD_HASH_WORKERS)))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '5'))
+
+# Admission control: token buckets refill at RATE requests/second up to BURST (a rate of 0 disables the limit)
+RATE_LIMIT_POLL_RATE = float(os.environ.get('RATE_LIMIT_POLL_RATE', '2'))  # per user, /api/cart_count
+RATE_LIMIT_POLL_BURST = float(os.environ.get('RATE_LIMIT_POLL_BURST', '10'))
+RATE_LIMIT_MUTATION_RATE = float(os.environ.get('RATE_LIMIT_MUTATION_RATE', '5'))  # per user, cart and checkout
+RATE_LIMIT_MUTATION_BURST = float(os.environ.get('RATE_LIMIT_MUTATION_BURST', '20'))
+RATE_LIMIT_GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_GLOBAL_RATE', '1000'))  # per process, all of the above
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', '2000'))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))  # per-user buckets kept in memory
+
+# Concurrent calls per dependency (0 disables the limit). Request threads give up with a 503 once
+# MAX_WAITING calls are already queued or after DEPENDENCY_QUEUE_TIMEOUT; background workers just wait.
+DYNAMODB_MAX_CONCURRENCY = int(os.environ.get('DYNAMODB_MAX_CONCURRENCY', '64'))
+DYNAMODB_MAX_WAITING = int(os.environ.get('DYNAMODB_MAX_WAITING', '64'))
+SNS_MAX_CONCURRENCY = int(os.environ.get('SNS_MAX_CONCURRENCY', '8'))
+SNS_MAX_WAITING = int(os.environ.get('SNS_MAX_WAITING', '32'))
+DEPENDENCY_QUEUE_TIMEOUT = float(os.environ.get('DEPENDENCY_QUEUE_TIMEOUT', '0.5'))
+
+# Cart batch and bulk import configuration
+CART_BATCH_MAX_OPERATIONS = int(os.environ.get('CART_BATCH_MAX_OPERATIONS', '100'))
+CART_BATCH_RETRIES = int(os.environ.get('CART_BATCH_RETRIES', '3'))  # re-reads when the cart changes mid-batch
+DYNAMODB_BATCH_WRITE_SIZE = 25  # BatchWriteItem request limit
+DYNAMODB_BATCH_GET_SIZE = 100  # BatchGetItem request limit
+BATCH_MAX_ATTEMPTS = int(os.environ.get('BATCH_MAX_ATTEMPTS', '8'))  # requests per chunk while items stay unprocessed
+BATCH_RETRY_DELAY = float(os.environ.get('BATCH_RETRY_DELAY', '0.05'))  # doubled after each attempt, up to 5s
+
+# Blocking I/O offload pool for async (ASGI) handlers
+IO_THREADS = int(os.environ.get('IO_THREADS', '32'))
+IO_MAX_PENDING = int(os.environ.get('IO_MAX_PENDING', '256'))  # queued or running calls before shedding with a 503
+
+# Listing pagination configuration
+BOOKS_PER_PAGE = int(os.environ.get('BOOKS_PER_PAGE', '24'))
+BOOKS_MAX_PER_PAGE = int(os.environ.get('BOOKS_MAX_PER_PAGE', '100'))
+BOOK_SORT_KEYS = ('title', 'price', 'year')
+
+# HTTP caching configuration
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', '256'))
+BROWSE_MAX_AGE = int(os.environ.get('BROWSE_MAX_AGE', '300'))
+PUBLIC_PAGE_MAX_AGE = int(os.environ.get('PUBLIC_PAGE_MAX_AGE', '3600'))
+
+# Search configuration
+SEARCH_MAX_LIMIT = 100
+API_BOOKS_MAX_IDS = int(os.environ.get('API_BOOKS_MAX_IDS', '100'))  # ids accepted by /api/books
+
+# Related books configuration (top-k per book, rebuilt on every catalog load)
+RELATED_BOOKS_K = int(os.environ.get('RELATED_BOOKS_K', '6'))
+RELATED_MAX_DF = float(os.environ.get('RELATED_MAX_DF', '0.05'))  # ignore terms in more than this share of books
+RELATED_MAX_TERMS = int(os.environ.get('RELATED_MAX_TERMS', '12'))  # strongest terms kept per book
+RELATED_MAX_POSTINGS = int(os.environ.get('RELATED_MAX_POSTINGS', '50'))  # strongest books kept per term
+RELATED_AUTHOR_WEIGHT = float(os.environ.get('RELATED_AUTHOR_WEIGHT', '0.5'))
+RELATED_GENRE_WEIGHT = float(os.environ.get('RELATED_GENRE_WEIGHT', '0.2'))
+RELATED_INLINE_MAX = int(os.environ.get('RELATED_INLINE_MAX', '5000'))  # larger catalogs build on a background thread
+# Written by `flask build-related`; loaded instead of rebuilding while it matches the catalog file
+RELATED_BOOKS_PATH = os.environ.get('RELATED_BOOKS_PATH', os.path.join('data', 'related_books.json'))
+SEARCH_STOPWORDS = frozenset('a an and are as at be by for from in into is it of on or the to with'.split())
+PRICE_BANDS = [(10, 'under $10'), (20, '$10-$20'), (50, '$20-$50'), (None, '$50 and over')]
+
+# Metrics configuration (histogram bucket upper bounds, in seconds)
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    """Latency histogram in Prometheus style.
+
+    Each thread records into its own shard, so observe() takes no lock
+    except the first time a thread uses the histogram; shards are merged
+    when /metrics is scraped. Shards of threads that have exited are folded
+    into a base series, so servers that start a thread per request keep
+    one shard per live thread rather than one per request ever served.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) pairs
+        self._base = {}
+        self._shards_lock = threading.Lock()
+
+    def _new_series(self):
+        # One slot per bucket, one for +Inf, then the running sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    @staticmethod
+    def _merge_into(merged, shard, new_series):
+        for labels, series in list(shard.items()):
+            total = merged.get(labels)
+            if total is None:
+                total = merged[labels] = new_series()
+            for index, value in enumerate(series):
+                total[index] += value
+
+    def _prune(self):
+        """Fold the shards of exited threads into the base series; call with _shards_lock held"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # The thread can no longer write to its shard, so merging it is safe
+                self._merge_into(self._base, shard, self._new_series)
+        self._shards = live
+
+    def observe(self, labels, value):
+        """Record one observation for a tuple of label values"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._prune()
+                self._shards.append((threading.current_thread(), shard))
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = self._new_series()
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        """Decorator recording the wall time of each call under the given labels"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(labels, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def collect(self):
+        """Merge the base series and the per-thread shards into {labels: series}"""
+        with self._shards_lock:
+            self._prune()
+            shards = [shard for _, shard in self._shards]
+            merged = {labels: list(series) for labels, series in self._base.items()}
+        for shard in shards:
+            self._merge_into(merged, shard, self._new_series)
+        return merged
+
+    def render(self):
+        """Prometheus text exposition lines for this histogram"""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.collect().items()):
+            label_text = ','.join(f'{name}="{metric_label(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = f'{label_text},' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
 
-def load_books():
-    """Load books data from JSON file"""
+def metric_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_LATENCY = Histogram(
+    'bookbazar_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status')
+)
+DEPENDENCY_LATENCY = Histogram(
+    'bookbazar_dependency_duration_seconds', 'Latency of storage, SNS, catalog and template calls.',
+    ('dependency', 'operation')
+)
+
+
+@DEPENDENCY_LATENCY.time('catalog', 'load_books')
+def load_books(books_path=BOOKS_PATH):
+    """Load books data from JSON file, or from a compact catalog compiled from one"""
+    if is_compact_catalog(books_path):
+        with CompactCatalog(books_path) as compact:
+            return list(compact)
     try:
-        books_path = os.path.join('data', 'books.json')
         with open(books_path, 'r') as f:
             return json.load(f)
     except FileNotFoundError:
@@ -75,95 +395,2933 @@ def load_books():
             }
         ]
 
-def decimal_to_float(obj):
-    """Convert DynamoDB Decimal to float for JSON serialization"""
-    if isinstance(obj, list):
-        return [decimal_to_float(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: decimal_to_float(value) for key, value in obj.items()}
-    elif isinstance(obj, Decimal):
-        return float(obj)
-    return obj
+def load_image_manifest(manifest_path=IMAGE_MANIFEST_PATH):
+    """Load the cover image manifest written by tools/build_images.py, or {} if it has not been built"""
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading image manifest {manifest_path}: {e}")
+        return {}
+
+def normalize_image_path(path):
+    """Map the catalog's mixed cover paths (../static/images/x, static/images/x, images/x) to images/x"""
+    if not path or '://' in path:
+        return path
+    path = posixpath.normpath('/' + path.replace('\\', '/')).lstrip('/')
+    static_prefix = app.static_url_path.strip('/') + '/'
+    return path[len(static_prefix):] if path.startswith(static_prefix) else path
+
+def static_asset_url(path):
+    return f"{app.static_url_path}/{quote(path)}"
+
+def resolve_book_image(book, manifest):
+    """Point the book's cover at its hashed build files, falling back to the original static file"""
+    path = normalize_image_path(book.get('image'))
+    if not path or '://' in path:
+        return
+    entry = manifest.get(path)
+    if entry is None:
+        book['image'] = static_asset_url(path)
+        return
+    book['image'] = static_asset_url(entry['src'])
+    for key, mime_type in (('image_srcset', 'image/jpeg'), ('image_webp_srcset', 'image/webp')):
+        srcset = ', '.join(f"{static_asset_url(variant['path'])} {variant['width']}w"
+                           for variant in entry.get('variants', ()) if variant['type'] == mime_type)
+        if srcset:
+            book[key] = srcset
+
+def book_api_fields(book):
+    """Public JSON representation of a book (modal.js reads cover_image)"""
+    return {
+        'id': book['id'],
+        'title': book.get('title'),
+        'author': book.get('author'),
+        'genre': book.get('genre'),
+        'year': book.get('year'),
+        'price': book.get('price'),
+        'description': book.get('description'),
+        'cover_image': book.get('image'),
+        'cover_srcset': book.get('image_srcset'),
+    }
+
+def price_to_cents(price):
+    """Convert a price (float, Decimal, int or str) to integer cents"""
+    return int(round(Decimal(str(price)) * 100))
+
+def cents_to_amount(cents):
+    """Convert integer cents to a float amount for display"""
+    return cents / 100
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    """Split text into lowercase search tokens, dropping stopwords"""
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(str(text).lower()) if token not in SEARCH_STOPWORDS]
+
+def year_range_label(year):
+    """Facet label for a publication year, e.g. 1925 -> '1920s'"""
+    return f"{int(year) // 10 * 10}s"
+
+def price_band_label(price):
+    """Facet label for a price"""
+    for upper, label in PRICE_BANDS:
+        if upper is None or price < upper:
+            return label
+
+def book_sort_value(book, sort):
+    """Sort value of a book for a listing sort key"""
+    if sort == 'title':
+        return (book.get('title') or '').lower()
+    value = book.get(sort)
+    return value if value is not None else 0
+
+def encode_cursor(sort_value, book_id):
+    """Opaque pagination cursor pointing just after the given book"""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, book_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor into a (sort_value, book_id) tuple, or None if invalid"""
+    try:
+        sort_value, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (sort_value, book_id)
+    except (ValueError, TypeError):
+        return None
+
+class SearchIndex:
+    """Inverted index over the catalog for full-text search with facets.
+
+    Given the compact catalog the books were decoded from, price/year
+    filters and facets read its columns instead of keeping per-book copies.
+    """
+
+    FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'genre': 1.5, 'description': 1.0}
+
+    def __init__(self, books, compact=None):
+        self.compact = compact
+        self.ids = []
+        self.postings = {}
+        self.genre_ids = {}
+        self.genre_labels = {}
+        self.year_facet = {}
+        self.price_facet = {}
+        by_year, by_price = [], []
+
+        for book in books:
+            book_id = book['id']
+            self.ids.append(book_id)
+            weights = {}
+            for field, field_weight in self.FIELD_WEIGHTS.items():
+                for token in tokenize(book.get(field)):
+                    weights[token] = weights.get(token, 0.0) + field_weight
+            for token, weight in weights.items():
+                self.postings.setdefault(token, {})[book_id] = weight
+
+            genre = book.get('genre')
+            if genre:
+                self.genre_ids.setdefault(genre.lower(), set()).add(book_id)
+            if compact is not None:
+                continue
+            if genre:
+                self.genre_labels[book_id] = genre
+            if book.get('year') is not None:
+                self.year_facet[book_id] = year_range_label(book['year'])
+                by_year.append((book['year'], book_id))
+            if book.get('price') is not None:
+                self.price_facet[book_id] = price_band_label(book['price'])
+                by_price.append((book['price'], book_id))
+
+        total = len(self.ids)
+        self.idf = {token: math.log(1 + total / len(ids)) for token, ids in self.postings.items()}
+        self.by_year = sorted(by_year)
+        self.by_price = sorted(by_price)
+        self.all_facets = self.facets(self.ids)
+
+    def _range_ids(self, sorted_pairs, low, high):
+        """Ids whose value lies in [low, high], using binary search on (value, id) pairs"""
+        start = 0 if low is None else bisect.bisect_left(sorted_pairs, (low, -math.inf))
+        end = len(sorted_pairs) if high is None else bisect.bisect_right(sorted_pairs, (high, math.inf))
+        return {book_id for _, book_id in sorted_pairs[start:end]}
+
+    def _filter_ids(self, genre, year_min, year_max, price_min, price_max):
+        """Intersect the facet filters; returns None when no filter is set"""
+        selected = None
+        if genre:
+            selected = set(self.genre_ids.get(genre.lower(), ()))
+        if self.compact is not None:
+            if year_min is None and year_max is None and price_min is None and price_max is None:
+                return selected
+            ids = set(self.compact.filter_ids(
+                price_min_cents=None if price_min is None else math.ceil(round(price_min * 100, 6)),
+                price_max_cents=None if price_max is None else math.floor(round(price_max * 100, 6)),
+                year_min=year_min, year_max=year_max
+            ))
+            return ids if selected is None else selected & ids
+        if year_min is not None or year_max is not None:
+            ids = self._range_ids(self.by_year, year_min, year_max)
+            selected = ids if selected is None else selected & ids
+        if price_min is not None or price_max is not None:
+            ids = self._range_ids(self.by_price, price_min, price_max)
+            selected = ids if selected is None else selected & ids
+        return selected
+
+    def facets(self, book_ids):
+        """Count genre, year range and price band facets over the given ids"""
+        if self.compact is not None:
+            return self._compact_facets(book_ids)
+        facets = {}
+        for name, labels in (('genre', self.genre_labels), ('year', self.year_facet), ('price', self.price_facet)):
+            counts = Counter(map(labels.get, book_ids))
+            counts.pop(None, None)
+            facets[name] = dict(counts)
+        return facets
+
+    def _compact_facets(self, book_ids):
+        compact = self.compact
+        genres, years, prices = Counter(), Counter(), Counter()
+        for book_id in book_ids:
+            row = compact.row_of(book_id)
+            genre = compact.field_bytes(row, 'genre')
+            if genre:
+                genres[str(genre, 'utf-8')] += 1
+            year = compact.years[row]
+            if year != MISSING_YEAR:
+                years[year_range_label(year)] += 1
+            prices[price_band_label(compact.price_cents[row] / 100)] += 1
+        return {'genre': dict(genres), 'year': dict(years), 'price': dict(prices)}
+
+    def search(self, query='', genre=None, year_min=None, year_max=None,
+               price_min=None, price_max=None, limit=20, offset=0):
+        """Return ranked matches for a query, with facet counts over all matches"""
+        tokens = sorted(set(tokenize(query)), key=lambda token: len(self.postings.get(token, ())))
+        filter_ids = self._filter_ids(genre, year_min, year_max, price_min, price_max)
+
+        if not tokens:
+            if filter_ids is None:
+                matches = self.ids
+                facets = self.all_facets
+            else:
+                matches = sorted(filter_ids)
+                facets = self.facets(matches)
+            page = matches[offset:offset + limit]
+            return {'total': len(matches), 'results': [(book_id, 0.0) for book_id in page], 'facets': facets}
+
+        # Intersect postings starting from the rarest token
+        candidates = set(self.postings.get(tokens[0], ()))
+        for token in tokens[1:]:
+            if not candidates:
+                break
+            candidates &= self.postings.get(token, {}).keys()
+        if filter_ids is not None:
+            candidates &= filter_ids
+
+        scores = {
+            book_id: sum(self.postings[token][book_id] * self.idf[token] for token in tokens)
+            for book_id in candidates
+        }
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return {'total': len(scores), 'results': ranked[offset:], 'facets': self.facets(scores)}
+
+def build_related_books(books, k=RELATED_BOOKS_K, max_df=RELATED_MAX_DF, max_terms=RELATED_MAX_TERMS,
+                        max_postings=RELATED_MAX_POSTINGS):
+    """Top-k related book ids for every book, as {book_id: [book_id, ...]}.
+
+    Books are scored by cosine similarity of sparse TF-IDF vectors over
+    title and description, accumulated through an inverted index, plus a
+    bonus for the same author or genre. Terms in more than max_df of the
+    books, all but each book's max_terms strongest terms and all but each
+    term's max_postings strongest books are pruned, which keeps the build
+    close to linear in the catalog size. Books with fewer than k matches
+    are topped up with the same genre's books nearest in year.
+    """
+    count = len(books)
+    ids = [book['id'] for book in books]
+    authors = [(book.get('author') or '').lower() for book in books]
+    genres = [(book.get('genre') or '').lower() for book in books]
+    years = [book.get('year') or 0 for book in books]
+
+    term_counts = [Counter(tokenize(book.get('title')) + tokenize(book.get('description'))) for book in books]
+    document_frequency = Counter()
+    for counts in term_counts:
+        document_frequency.update(counts.keys())
+    # Small catalogs keep every shared term; a term in only one book relates nothing
+    df_limit = max(50, int(max_df * count))
+    idf = {term: math.log(count / df) for term, df in document_frequency.items() if 1 < df <= df_limit}
+
+    vectors = []
+    postings = {}
+    for index, counts in enumerate(term_counts):
+        weights = [((1 + math.log(tf)) * idf[term], term) for term, tf in counts.items() if term in idf]
+        if len(weights) > max_terms:
+            weights = heapq.nlargest(max_terms, weights)
+        norm = math.sqrt(sum(weight * weight for weight, _ in weights)) or 1.0
+        vector = [(term, weight / norm) for weight, term in weights]
+        vectors.append(vector)
+        for term, weight in vector:
+            postings.setdefault(term, []).append((weight, index))
+    for term, entries in postings.items():
+        if len(entries) > max_postings:
+            postings[term] = heapq.nlargest(max_postings, entries)
+
+    by_author = {}
+    by_genre = {}
+    for index in range(count):
+        if authors[index]:
+            by_author.setdefault(authors[index], []).append(index)
+        if genres[index]:
+            by_genre.setdefault(genres[index], []).append((years[index], ids[index], index))
+    for members in by_genre.values():
+        members.sort()
+
+    related = {}
+    for index, vector in enumerate(vectors):
+        scores = defaultdict(float)
+        for term, weight in vector:
+            for other_weight, other in postings[term]:
+                scores[other] += weight * other_weight
+        for other in by_author.get(authors[index], ())[:max_postings]:
+            scores[other] += RELATED_AUTHOR_WEIGHT
+        scores.pop(index, None)
+        genre = genres[index]
+        if genre:
+            for other in scores:
+                if genres[other] == genre:
+                    scores[other] += RELATED_GENRE_WEIGHT
+        picks = [ids[other] for other in heapq.nlargest(k, scores, key=scores.__getitem__)]
+
+        if len(picks) < k and genre:
+            members = by_genre[genre]
+            position = bisect.bisect_left(members, (years[index], ids[index], index))
+            window = members[max(0, position - k):position + k + 1]
+            chosen = set(picks)
+            for _, other_id, _ in sorted(window, key=lambda member: (abs(member[0] - years[index]), member[1])):
+                if len(picks) == k:
+                    break
+                if other_id != ids[index] and other_id not in chosen:
+                    picks.append(other_id)
+                    chosen.add(other_id)
+        related[ids[index]] = picks
+    return related
+
+def file_digest(path):
+    """SHA-256 of a file's contents, or None if it cannot be read"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def load_related_books(related_path, books_digest):
+    """Load a prebuilt related-books table if it was built from the current catalog file, else None"""
+    try:
+        with open(related_path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading related books {related_path}: {e}")
+        return None
+    if books_digest is None or data.get('books_digest') != books_digest:
+        logger.info(f"Ignoring {related_path}: built from a different catalog")
+        return None
+    return {int(book_id): related for book_id, related in data['related'].items()}
+
+def compact_sort_value(compact, row, sort):
+    """book_sort_value of the book at a compact catalog row, read without decoding the book"""
+    if sort == 'title':
+        title = compact.field_bytes(row, 'title')
+        return str(title, 'utf-8').lower() if title is not None else ''
+    if sort == 'price':
+        return compact.price_cents[row] / 100
+    year = compact.years[row]
+    return year if year != MISSING_YEAR else 0
+
+class CompactSortedBooks(Sequence):
+    """A compact catalog's books in one listing order, given as an array of row numbers"""
+
+    def __init__(self, books, rows):
+        self.books = books
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.books[row] for row in self.rows[index]]
+        return self.books[self.rows[index]]
+
+class CompactSortKeys(Sequence):
+    """(sort value, id) at each position of a CompactSortedBooks, for bisecting pagination cursors"""
+
+    def __init__(self, compact, rows, sort):
+        self.compact = compact
+        self.rows = rows
+        self.sort = sort
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        row = self.rows[index]
+        return (compact_sort_value(self.compact, row, self.sort), self.compact.ids[row])
+
+class CompactBooks(Sequence):
+    """Books of a mapped compact catalog in id order, decoded (covers resolved) only when accessed.
+
+    The listing orders and the search index are built the first time they
+    are used and live as long as this load of the catalog.
+    """
+
+    def __init__(self, compact, manifest):
+        self.compact = compact
+        self.manifest = manifest
+        self._sorted_views = {}
+        self._search_index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.compact)
+
+    def _book(self, row):
+        book = self.compact.book_at(row)
+        resolve_book_image(book, self.manifest)
+        return book
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._book(row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._book(index)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self._book(row)
+
+    def get(self, book_id):
+        """Return the book with the given id, or None"""
+        row = self.compact.row_of(book_id)
+        return None if row is None else self._book(row)
+
+    def sorted_view(self, sort):
+        """(keys, books) in one listing order, from an array of rows sorted on first use"""
+        view = self._sorted_views.get(sort)
+        if view is None:
+            with self._lock:
+                view = self._sorted_views.get(sort)
+                if view is None:
+                    compact = self.compact
+                    rows = array('I', sorted(range(len(compact)),
+                                             key=lambda row: compact_sort_value(compact, row, sort)))
+                    view = self._sorted_views[sort] = (CompactSortKeys(compact, rows, sort),
+                                                       CompactSortedBooks(self, rows))
+        return view
+
+    def search_index(self):
+        """The search index, built on first use; filters and facets read the mapped columns"""
+        if self._search_index is None:
+            with self._lock:
+                if self._search_index is None:
+                    started = time.perf_counter()
+                    self._search_index = SearchIndex(self, compact=self.compact)
+                    logger.info(f"Search index built for {len(self)} books in {time.perf_counter() - started:.1f}s")
+        return self._search_index
+
+class CompactPriceCents(Mapping):
+    """{book_id: price in cents} read from a compact catalog's price column"""
+
+    def __init__(self, compact):
+        self.compact = compact
+
+    def __getitem__(self, book_id):
+        row = self.compact.row_of(book_id) if isinstance(book_id, int) else None
+        if row is None:
+            raise KeyError(book_id)
+        return self.compact.price_cents[row]
+
+    def __iter__(self):
+        return iter(self.compact.ids)
+
+    def __len__(self):
+        return len(self.compact)
+
+class BookCatalog:
+    """Book catalog indexed by id, reloaded when books.json changes.
+
+    A books.json catalog is parsed into per-process dicts and indexes. A
+    compiled compact catalog stays mapped instead: lookups, prices and
+    price/year filters read the shared mapping, and the listing orders and
+    search index are only built the first time they are used.
+    """
+
+    def __init__(self, books_path=BOOKS_PATH, check_interval=CATALOG_CHECK_INTERVAL,
+                 manifest_path=IMAGE_MANIFEST_PATH, related_path=RELATED_BOOKS_PATH):
+        self.books_path = books_path
+        self.manifest_path = manifest_path
+        self.related_path = related_path
+        self.check_interval = check_interval
+        self.books = []
+        self.compact = None
+        self.by_id = {}
+        self.price_cents = {}
+        self.book_json = {}
+        self.related = {}
+        self.search_index = SearchIndex([])
+        self.sorted_views = {}
+        self.version = 0
+        self.revision = ''
+        self.last_modified = None
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    @staticmethod
+    def _stat(path):
+        """Return (mtime, size) of a file, or None if it is missing"""
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _file_signature(self):
+        """Return the (mtime, size) of books.json, the image manifest and the prebuilt related books"""
+        return (self._stat(self.books_path), self._stat(self.manifest_path), self._stat(self.related_path))
+
+    def reload(self, force=False):
+        """Re-read books.json if it, the image manifest or the related books changed since the last load"""
+        with self._lock:
+            signature = self._file_signature()
+            if not force and self.version and signature == self._signature:
+                return False
+
+            manifest = load_image_manifest(self.manifest_path)
+            if is_compact_catalog(self.books_path):
+                # Replaced files are not closed: requests may still hold views of the old mapping
+                self.compact = CompactCatalog(self.books_path)
+                books = CompactBooks(self.compact, manifest)
+                self.search_index = None
+                self.sorted_views = {}
+                self.by_id = {}
+                self.price_cents = CompactPriceCents(self.compact)
+                self.book_json = {}
+            else:
+                self.compact = None
+                books = load_books(self.books_path)
+                for book in books:
+                    resolve_book_image(book, manifest)
+                self.search_index = SearchIndex(books)
+                self.sorted_views = self._build_sorted_views(books)
+                self.by_id = {book['id']: book for book in books}
+                self.price_cents = {book['id']: price_to_cents(book.get('price', 0)) for book in books}
+                # Serialized once per load so the JSON API only joins bytes
+                self.book_json = {book['id']: self._serialize(book) for book in books}
+            related = None
+            if signature[2] is not None:
+                related = load_related_books(self.related_path, file_digest(self.books_path))
+            if related is None and len(books) <= RELATED_INLINE_MAX:
+                related = build_related_books(books)
+            # None until built; large catalogs are indexed off the request path
+            self.related = related
+            self.books = books
+            self._signature = signature
+            # Derived from the file itself so every worker reports the same revision
+            self.revision = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+            mtimes = [stat[0] for stat in signature if stat]
+            modified = max(mtimes) / 1e9 if mtimes else time.time()
+            self.last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+            self.version += 1
+            logger.info(f"Catalog loaded: {len(books)} books (version {self.version})")
+            if self.related is None:
+                threading.Thread(target=self._build_related, args=(books, self.version),
+                                 name='related-books', daemon=True).start()
+            return True
+
+    def _build_related(self, books, version):
+        """Build the related-books table on a background thread, unless the catalog reloads meanwhile"""
+        started = time.perf_counter()
+        related = build_related_books(books)
+        with self._lock:
+            if self.version != version:
+                return
+            self.related = related
+        logger.info(f"Related books built for {len(books)} books in {time.perf_counter() - started:.1f}s")
+
+    @staticmethod
+    def _serialize(book):
+        return json.dumps(book_api_fields(book), separators=(',', ':')).encode()
+
+    @staticmethod
+    def _build_sorted_views(books):
+        """Pre-sort the books once per load for every listing sort key"""
+        views = {}
+        for sort in BOOK_SORT_KEYS:
+            keys = sorted((book_sort_value(book, sort), book['id'], index) for index, book in enumerate(books))
+            views[sort] = ([key[:2] for key in keys], [books[index] for _, _, index in keys])
+        return views
+
+    def refresh(self):
+        """Check the catalog file for changes at most once per check interval"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        self.reload()
+
+    def all_books(self):
+        """Return the list of all books"""
+        self.refresh()
+        return self.books
+
+    def get(self, book_id):
+        """Return the book with the given id, or None"""
+        self.refresh()
+        books = self.books
+        if isinstance(books, CompactBooks):
+            return books.get(book_id)
+        return self.by_id.get(book_id)
+
+    def _json(self, books, book_id):
+        if isinstance(books, CompactBooks):
+            book = books.get(book_id)
+            return self._serialize(book) if book is not None else None
+        return self.book_json.get(book_id)
+
+    def get_json(self, book_id):
+        """Return the book's API JSON (pre-serialized for books.json catalogs), or None"""
+        self.refresh()
+        return self._json(self.books, book_id)
+
+    def get_json_many(self, book_ids):
+        """Return ([API JSON of each book found, in order], [ids not found])"""
+        self.refresh()
+        books = self.books
+        found, missing = [], []
+        for book_id in book_ids:
+            body = self._json(books, book_id)
+            if body is None:
+                missing.append(book_id)
+            else:
+                found.append(body)
+        return found, missing
+
+    def related_ids(self, book_id):
+        """Ids of the books related to book_id, or None while the table is still being built"""
+        self.refresh()
+        related = self.related
+        return None if related is None else related.get(book_id, [])
+
+    def page(self, sort='title', descending=False, page=1, per_page=BOOKS_PER_PAGE, cursor=None):
+        """Return one page of books in sort order.
+
+        Pages are addressed by number or by a cursor from a previous page's
+        next_cursor; cursors stay stable while books are added before them.
+        """
+        self.refresh()
+        if sort not in BOOK_SORT_KEYS:
+            sort = 'title'
+        books = self.books
+        if isinstance(books, CompactBooks):
+            keys, ordered = books.sorted_view(sort)
+        else:
+            keys, ordered = self.sorted_views.get(sort, ([], []))
+        total = len(ordered)
+
+        position = decode_cursor(cursor) if cursor else None
+        if position is not None:
+            try:
+                if descending:
+                    offset = total - bisect.bisect_left(keys, position)
+                else:
+                    offset = bisect.bisect_right(keys, position)
+            except TypeError:
+                offset = 0  # Cursor from a different sort key
+        else:
+            offset = (page - 1) * per_page
+
+        if descending:
+            end = total - offset
+            books = ordered[max(end - per_page, 0):max(end, 0)][::-1]
+        else:
+            books = ordered[offset:offset + per_page]
+
+        next_cursor = None
+        if books and offset + len(books) < total:
+            last = books[-1]
+            next_cursor = encode_cursor(book_sort_value(last, sort), last['id'])
+
+        return {
+            'books': books,
+            'offset': offset,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+            'page': offset // per_page + 1,
+            'per_page': per_page,
+            'pages': max((total + per_page - 1) // per_page, 1),
+            'total': total,
+            'next_cursor': next_cursor
+        }
+
+    def search(self, query, **filters):
+        """Search the catalog; see SearchIndex.search"""
+        self.refresh()
+        books = self.books
+        index = books.search_index() if isinstance(books, CompactBooks) else self.search_index
+        return index.search(query, **filters)
+
+catalog = BookCatalog()
+
+class FragmentCache:
+    """Bounded LRU cache of rendered template fragments"""
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Return the cached fragment for key, rendering and storing it on a miss"""
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        fragment = Markup(render())
+        with self._lock:
+            self._entries[key] = fragment
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+fragment_cache = FragmentCache()
+
+class CartCache:
+    """Per-process LRU cache of user carts with a TTL and a size bound"""
+
+    def __init__(self, max_size=CART_CACHE_SIZE, ttl=CART_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        """Return a copy of the cached cart lines, or None on a miss or expiry"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, username, lines):
+        """Store a copy of the cart lines, evicting the least recently used entries"""
+        lines = dict(lines)
+        with self._lock:
+            self._entries[username] = (time.monotonic() + self.ttl, lines)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set_line(self, username, book_id, quantity):
+        """Apply a single line change to a cached cart, if it is cached"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            if quantity > 0:
+                entry[1][book_id] = quantity
+            else:
+                entry[1].pop(book_id, None)
+
+    def invalidate(self, username):
+        """Drop the cached cart for a user"""
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+cart_cache = CartCache()
+
+# Cart codec: carts are stored as {book_id: quantity} and priced from the catalog
+
+def cart_line_attribute(book_id):
+    """Name of the cart item attribute holding the quantity of a book"""
+    return f'{CART_LINE_PREFIX}{book_id}'
+
+def encode_cart_lines(lines):
+    """Encode {book_id: quantity} as cart item attributes"""
+    return {f'{CART_LINE_PREFIX}{book_id}': quantity for book_id, quantity in lines.items()}
+
+def cart_lines_from_item(cart_data):
+    """Decode {book_id: quantity} from a cart item in a single pass"""
+    prefix_length = len(CART_LINE_PREFIX)
+    return {
+        int(name[prefix_length:]): int(value)
+        for name, value in cart_data.items()
+        if name.startswith(CART_LINE_PREFIX)
+    }
+
+def legacy_cart_lines(items):
+    """Decode {book_id: quantity} from a legacy list of book copies, reading only id and quantity"""
+    lines = {}
+    for item in items:
+        book_id = int(item['id'])
+        lines[book_id] = lines.get(book_id, 0) + int(item.get('quantity', 1))
+    return lines
+
+def cart_total_cents(cart_items):
+    """Total of hydrated cart items in integer cents"""
+    return sum(item['price_cents'] * item['quantity'] for item in cart_items)
+
+EMPTY_CART_SUMMARY = {'count': 0, 'subtotal_cents': 0}
+
+def cart_summary(lines):
+    """Item count and subtotal in cents of {book_id: quantity}, priced from the catalog"""
+    price_cents = catalog.price_cents
+    count = subtotal_cents = 0
+    for book_id, quantity in lines.items():
+        if book_id in price_cents:
+            count += quantity
+            subtotal_cents += quantity * price_cents[book_id]
+    return {'count': count, 'subtotal_cents': subtotal_cents}
+
+def cart_summary_from_item(cart_data):
+    """Read the stored cart aggregates from a cart item, or None if it has none"""
+    if 'item_count' not in cart_data or 'subtotal_cents' not in cart_data:
+        return None
+    return {'count': int(cart_data['item_count']), 'subtotal_cents': int(cart_data['subtotal_cents'])}
+
+def order_to_item(order):
+    """Flatten an order into a DynamoDB item; a pending confirmation sets the sparse outbox_pending flag"""
+    item = {key: order[key] for key in ('order_id', 'username', 'created_at', 'total_cents', 'lines', 'customer')}
+    if order['notification']:
+        item['notification_subject'] = order['notification']['subject']
+        item['notification_message'] = order['notification']['message']
+        item['outbox_pending'] = 1
+    return item
+
+def order_from_item(item):
+    """Rebuild an order from its DynamoDB item"""
+    notification = None
+    if 'notification_subject' in item:
+        notification = {'subject': item['notification_subject'], 'message': item['notification_message']}
+    return {
+        'order_id': item['order_id'],
+        'username': item['username'],
+        'created_at': item['created_at'],
+        'total_cents': int(item['total_cents']),
+        'lines': [{key: int(value) for key, value in line.items()} for line in item['lines']],
+        'customer': dict(item['customer']),
+        'notification': notification,
+        'notification_pending': 'outbox_pending' in item
+    }
+
+class TokenBucketLimiter:
+    """Token buckets refilled at rate per second up to burst, one per key in a bounded LRU"""
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.counters = {'allowed': 0, 'limited': 0}
+        self._buckets = OrderedDict()  # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def acquire(self, key=None, cost=1.0):
+        """Take cost tokens from key's bucket; returns 0.0 if admitted, else seconds until it could be"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.counters['allowed'] += 1
+                return 0.0
+            self.counters['limited'] += 1
+            return (cost - bucket[0]) / self.rate
+
+    def stats(self):
+        """Return admission counters and the number of tracked keys"""
+        with self._lock:
+            return dict(self.counters, keys=len(self._buckets))
+
+class DependencyOverloaded(Exception):
+    """Raised for request work when a dependency has too many calls in flight and queued"""
+
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"{name} is overloaded")
+        self.name = name
+        self.retry_after = retry_after
+
+class ConcurrencyLimiter:
+    """Caps the calls in flight to one dependency.
+
+    Callers beyond the limit queue for a slot. Request work (a Flask
+    request thread, or a block under shedding_overload) is shed with
+    DependencyOverloaded once max_waiting callers are queued or after
+    timeout, so a slow dependency turns into fast 503s instead of every
+    worker thread blocking on it. Background workers (notifications, the
+    outbox) have bounded queues of their own and always wait.
+    """
+
+    def __init__(self, name, limit, max_waiting, timeout=DEPENDENCY_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters = {'calls': 0, 'rejected': 0, 'timed_out': 0}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, shed=None):
+        """Hold one of the dependency's call slots for the duration of the block.
+
+        shed=None sheds request work and lets background work wait; True or False forces either.
+        """
+        if self.limit <= 0:
+            yield
+            return
+        if shed is None:
+            shed = has_request_context() or getattr(_shedding, 'active', False)
+        with self._cond:
+            if self.in_flight >= self.limit:
+                if shed and self.waiting >= self.max_waiting:
+                    self.counters['rejected'] += 1
+                    raise DependencyOverloaded(self.name)
+                deadline = time.monotonic() + self.timeout if shed else None
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self.counters['timed_out'] += 1
+                            raise DependencyOverloaded(self.name)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.counters['calls'] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+    def stats(self):
+        """Return call counters with the current in-flight and queued calls"""
+        with self._cond:
+            return dict(self.counters, in_flight=self.in_flight, waiting=self.waiting)
+
+_shedding = threading.local()
+
+@contextmanager
+def shedding_overload():
+    """Shed dependency calls made in the block like a request thread's, for request work run off one"""
+    previous = getattr(_shedding, 'active', False)
+    _shedding.active = True
+    try:
+        yield
+    finally:
+        _shedding.active = previous
+
+class ConcurrencyLimited:
+    """Proxy for a boto3 client or Table whose method calls each hold a ConcurrencyLimiter slot"""
+
+    def __init__(self, target, limiter):
+        self._target = target
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            with self._limiter.slot():
+                return attribute(*args, **kwargs)
+        return call
+
+rate_limiters = {
+    'poll': TokenBucketLimiter(RATE_LIMIT_POLL_RATE, RATE_LIMIT_POLL_BURST),
+    'mutation': TokenBucketLimiter(RATE_LIMIT_MUTATION_RATE, RATE_LIMIT_MUTATION_BURST),
+}
+global_rate_limiter = TokenBucketLimiter(RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST, max_keys=1)
+dependency_limiters = {
+    'dynamodb': ConcurrencyLimiter('dynamodb', DYNAMODB_MAX_CONCURRENCY, DYNAMODB_MAX_WAITING),
+    'sns': ConcurrencyLimiter('sns', SNS_MAX_CONCURRENCY, SNS_MAX_WAITING),
+}
+
+def admit(category, key):
+    """Charge a request to the caller's bucket for category and to the global bucket.
+
+    Returns 0.0 if it is admitted, otherwise the seconds to wait before retrying.
+    """
+    retry_after = rate_limiters[category].acquire(key)
+    if not retry_after:
+        retry_after = global_rate_limiter.acquire()
+    return retry_after
+
+class DynamoDBStorage:
+    """User, cart and order storage backed by the DynamoDB users, carts and orders tables"""
+
+    def __init__(self, users_table=None, carts_table=None, orders_table=None, client=None):
+        self._users_table = users_table
+        self._carts_table = carts_table
+        self._orders_table = orders_table
+        self._client = client
+
+    @property
+    def users_table(self):
+        return ConcurrencyLimited(self._users_table or aws.table('users'), dependency_limiters['dynamodb'])
+
+    @property
+    def carts_table(self):
+        return ConcurrencyLimited(self._carts_table or aws.table('carts'), dependency_limiters['dynamodb'])
+
+    @property
+    def orders_table(self):
+        return ConcurrencyLimited(self._orders_table or aws.table('orders'), dependency_limiters['dynamodb'])
+
+    @property
+    def client(self):
+        return ConcurrencyLimited(self._client or aws.client('dynamodb'), dependency_limiters['dynamodb'])
+
+    def get_user(self, username):
+        try:
+            response = self.users_table.get_item(Key={'username': username})
+            return response.get('Item')
+        except ClientError as e:
+            logger.error(f"Error getting user {username}: {e}")
+            return None
+
+    def update_password(self, username, password, current_password):
+        """Replace a user's stored password if it still equals current_password"""
+        try:
+            self.users_table.update_item(
+                Key={'username': username},
+                UpdateExpression='SET #password = :password',
+                ConditionExpression='#password = :current',
+                ExpressionAttributeNames={'#password': 'password'},
+                ExpressionAttributeValues={':password': password, ':current': current_password}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Error updating password for {username}: {e}")
+            return False
+
+    def create_user(self, username, password):
+        try:
+            self.users_table.put_item(
+                Item={
+                    'username': username,
+                    'password': password
+                },
+                ConditionExpression='attribute_not_exists(username)'
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False  # User already exists
+            logger.error(f"Error creating user {username}: {e}")
+            return False
+
+    def get_cart(self, username):
+        """Read the cart as ({book_id: quantity}, version), or None on error; every cart write bumps the version"""
+        try:
+            response = self.carts_table.get_item(Key={'username': username})
+        except ClientError as e:
+            logger.error(f"Error getting cart for {username}: {e}")
+            return None
+
+        cart_data = response.get('Item')
+        if not cart_data:
+            return {}, 0
+        if 'items' in cart_data:
+            # Migrating is a cart write, so read the cart again for its new version
+            if self.migrate_legacy_cart(username, cart_data) is None:
+                return None
+            return self.get_cart(username)
+        lines = cart_lines_from_item(cart_data)
+        self.repair_cart_summary(username, cart_summary_from_item(cart_data), cart_summary(lines))
+        return lines, int(cart_data.get('cart_version', 0))
+
+    def get_cart_lines(self, username):
+        cart = self.get_cart(username)
+        return cart[0] if cart is not None else None
+
+    def get_cart_summary(self, username):
+        """Read only the cart aggregates; carts without them are read in full and repaired"""
+        try:
+            response = self.carts_table.get_item(
+                Key={'username': username},
+                ProjectionExpression='#count, #subtotal',
+                ExpressionAttributeNames={'#count': 'item_count', '#subtotal': 'subtotal_cents'}
+            )
+        except ClientError as e:
+            logger.error(f"Error getting cart summary for {username}: {e}")
+            return None
+
+        summary = cart_summary_from_item(response.get('Item', {}))
+        if summary is not None:
+            return summary
+        lines = self.get_cart_lines(username)
+        return cart_summary(lines) if lines is not None else None
+
+    def repair_cart_summary(self, username, stored, expected):
+        """Rewrite the cart aggregates if they disagree with the cart lines"""
+        if stored == expected or (stored is None and expected == EMPTY_CART_SUMMARY):
+            return
+        names = {'#count': 'item_count', '#subtotal': 'subtotal_cents'}
+        values = {':count': expected['count'], ':subtotal': expected['subtotal_cents']}
+        if stored is None:
+            condition = 'attribute_not_exists(#count)'
+        else:
+            condition = '#count = :old_count AND #subtotal = :old_subtotal'
+            values[':old_count'] = stored['count']
+            values[':old_subtotal'] = stored['subtotal_cents']
+        try:
+            self.carts_table.update_item(
+                Key={'username': username},
+                UpdateExpression='SET #count = :count, #subtotal = :subtotal',
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+            logger.info(f"Repaired cart summary for {username}")
+        except ClientError as e:
+            # A concurrent write changed the cart; the next full read repairs it
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Error repairing cart summary for {username}: {e}")
+
+    def migrate_legacy_cart(self, username, cart_data):
+        """Convert a cart stored as a list of book copies into per-book quantity attributes"""
+        lines = cart_lines_from_item(cart_data)
+        legacy_lines = legacy_cart_lines(cart_data.get('items', []))
+
+        names = {'#items': 'items', '#version': 'cart_version'}
+        values = {':one': 1}
+        assignments = []
+        for index, (book_id, quantity) in enumerate(legacy_lines.items()):
+            names[f'#line{index}'] = cart_line_attribute(book_id)
+            values[f':qty{index}'] = quantity
+            assignments.append(f'#line{index} = if_not_exists(#line{index}, :zero) + :qty{index}')
+            lines[book_id] = lines.get(book_id, 0) + quantity
+
+        update_args = {
+            'Key': {'username': username},
+            'UpdateExpression': 'REMOVE #items ADD #version :one',
+            'ConditionExpression': 'attribute_exists(#items)',
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values
+        }
+        if assignments:
+            values[':zero'] = 0
+            update_args['UpdateExpression'] = f"SET {', '.join(assignments)} REMOVE #items ADD #version :one"
+        try:
+            self.carts_table.update_item(**update_args)
+            logger.info(f"Migrated legacy cart for {username}")
+            return lines
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Error migrating cart for {username}: {e}")
+                return None
+            # Migrated concurrently by another request
+            return self.get_cart_lines(username)
+
+    def legacy_cart_usernames(self):
+        """Yield the users whose carts are still stored as a list of book copies"""
+        scan_args = {
+            'FilterExpression': 'attribute_exists(#items)',
+            'ProjectionExpression': 'username',
+            'ExpressionAttributeNames': {'#items': 'items'}
+        }
+        while True:
+            response = self.carts_table.scan(**scan_args)
+            for item in response.get('Items', []):
+                yield item['username']
+            if 'LastEvaluatedKey' not in response:
+                return
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def migrate_legacy_carts(self):
+        """Migrate every legacy cart in the table, returning (migrated, failed) counts"""
+        migrated = failed = 0
+        for username in self.legacy_cart_usernames():
+            if self.get_cart_lines(username) is None:
+                failed += 1
+            else:
+                migrated += 1
+        return migrated, failed
+
+    @staticmethod
+    def _cart_item(username, lines, version):
+        cart_data = encode_cart_lines(lines)
+        cart_data['username'] = username
+        summary = cart_summary(lines)
+        cart_data['item_count'] = summary['count']
+        cart_data['subtotal_cents'] = summary['subtotal_cents']
+        cart_data['cart_version'] = version
+        return cart_data
+
+    @staticmethod
+    def _cart_condition(expected_version):
+        """Condition that the cart is still at expected_version, as (expression, names, values).
+
+        A single counter keeps the expression the same size however many lines the cart has.
+        """
+        names = {'#version': 'cart_version'}
+        values = {':version': expected_version}
+        if not expected_version:
+            # Carts not written since versioning was added, or never written, have no counter yet
+            return 'attribute_not_exists(#version) OR #version = :version', names, values
+        return '#version = :version', names, values
+
+    def replace_cart_lines(self, username, lines, expected_version):
+        """Write lines as the whole cart if it is still at expected_version.
+
+        Returns 'replaced', 'cart_changed' if the cart was modified since it was read, or None on error.
+        """
+        condition, names, values = self._cart_condition(expected_version)
+        try:
+            self.carts_table.put_item(
+                Item=self._cart_item(username, lines, expected_version + 1),
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+            return 'replaced'
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return 'cart_changed'
+            logger.error(f"Error replacing cart for {username}: {e}")
+            return None
+
+    def _batch_write(self, table_name, items):
+        """Put items with BatchWriteItem in chunks of 25, resending unprocessed items with backoff.
+
+        Returns {'written', 'retried', 'failed'} item counts.
+        """
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+
+        counts = {'written': 0, 'retried': 0, 'failed': 0}
+        for start in range(0, len(items), DYNAMODB_BATCH_WRITE_SIZE):
+            pending = [{'PutRequest': {'Item': {key: serializer.serialize(value) for key, value in item.items()}}}
+                       for item in items[start:start + DYNAMODB_BATCH_WRITE_SIZE]]
+            for attempt in range(BATCH_MAX_ATTEMPTS):
+                if attempt:
+                    counts['retried'] += len(pending)
+                    time.sleep(min(BATCH_RETRY_DELAY * 2 ** (attempt - 1), 5.0))
+                try:
+                    response = self.client.batch_write_item(RequestItems={table_name: pending})
+                except ClientError as e:
+                    logger.error(f"Error writing batch to {table_name}: {e}")
+                    break
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+                counts['written'] += len(pending) - len(unprocessed)
+                pending = unprocessed
+                if not pending:
+                    break
+            if pending:
+                logger.error(f"Giving up on {len(pending)} unprocessed writes to {table_name}")
+                counts['failed'] += len(pending)
+        return counts
+
+    def _batch_get(self, table_name, key_name, keys, projection=None):
+        """Read items with BatchGetItem in chunks of 100 keys, re-requesting unprocessed keys with backoff.
+
+        Returns {key: item} for the keys that exist, or None on error.
+        """
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        serializer, deserializer = TypeSerializer(), TypeDeserializer()
+
+        found = {}
+        for start in range(0, len(keys), DYNAMODB_BATCH_GET_SIZE):
+            request = {'Keys': [{key_name: serializer.serialize(key)}
+                                for key in keys[start:start + DYNAMODB_BATCH_GET_SIZE]]}
+            if projection:
+                request['ProjectionExpression'] = projection
+            for attempt in range(BATCH_MAX_ATTEMPTS):
+                if attempt:
+                    time.sleep(min(BATCH_RETRY_DELAY * 2 ** (attempt - 1), 5.0))
+                try:
+                    response = self.client.batch_get_item(RequestItems={table_name: request})
+                except ClientError as e:
+                    logger.error(f"Error reading batch from {table_name}: {e}")
+                    return None
+                for item in response.get('Responses', {}).get(table_name, []):
+                    item = {name: deserializer.deserialize(value) for name, value in item.items()}
+                    found[item[key_name]] = item
+                request = response.get('UnprocessedKeys', {}).get(table_name)
+                if not request:
+                    break
+            if request:
+                logger.error(f"Giving up on {len(request['Keys'])} unprocessed reads from {table_name}")
+                return None
+        return found
+
+    def existing_usernames(self, usernames):
+        """The subset of usernames that already have an account, or None on error"""
+        found = self._batch_get(self.users_table.name, 'username', list(usernames), projection='username')
+        return set(found) if found is not None else None
+
+    def put_users(self, users):
+        """Write user items ({'username', 'password'}), replacing any existing ones"""
+        return self._batch_write(self.users_table.name, list(users))
+
+    def get_carts(self, usernames):
+        """{username: (lines, version)} for the users that have a cart, or None on error"""
+        found = self._batch_get(self.carts_table.name, 'username', list(usernames))
+        if found is None:
+            return None
+        carts = {}
+        for username, cart_data in found.items():
+            lines = cart_lines_from_item(cart_data)
+            # Legacy carts are converted when they are written back
+            for book_id, quantity in legacy_cart_lines(cart_data.get('items', [])).items():
+                lines[book_id] = lines.get(book_id, 0) + quantity
+            carts[username] = (lines, int(cart_data.get('cart_version', 0)))
+        return carts
+
+    def put_carts(self, carts):
+        """Write whole carts from {username: (lines, version read, or None if there was no cart)}.
+
+        New carts go out in batches; existing ones are written one at a time
+        on the condition that they are still at the version read. Returns
+        {'written', 'retried', 'failed'} counts and the 'changed' usernames
+        whose cart was modified since it was read.
+        """
+        new = [self._cart_item(username, lines, 1) for username, (lines, version) in carts.items() if version is None]
+        result = self._batch_write(self.carts_table.name, new) if new else {'written': 0, 'retried': 0, 'failed': 0}
+        result['changed'] = []
+        for username, (lines, version) in carts.items():
+            if version is None:
+                continue
+            status = self.replace_cart_lines(username, lines, version)
+            if status == 'replaced':
+                result['written'] += 1
+            elif status == 'cart_changed':
+                result['changed'].append(username)
+            else:
+                result['failed'] += 1
+        return result
+
+    def change_cart_quantity(self, username, book_id, delta, price_cents):
+        line = cart_line_attribute(book_id)
+        update_args = {
+            'Key': {'username': username},
+            'UpdateExpression': 'ADD #line :delta, #count :delta, #subtotal :cents, #version :one',
+            'ExpressionAttributeNames': {'#line': line, '#count': 'item_count', '#subtotal': 'subtotal_cents',
+                                         '#version': 'cart_version'},
+            'ExpressionAttributeValues': {':delta': delta, ':cents': delta * price_cents, ':one': 1},
+            'ReturnValues': 'UPDATED_NEW'
+        }
+        if delta < 0:
+            update_args['ConditionExpression'] = '#line > :min'
+            update_args['ExpressionAttributeValues'][':min'] = -delta
+
+        try:
+            response = self.carts_table.update_item(**update_args)
+            return int(response['Attributes'][line])
+        except ClientError as e:
+            if delta < 0 and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return 0 if self.remove_cart_line(username, book_id, price_cents) is not None else None
+            logger.error(f"Error updating cart for {username}: {e}")
+            return None
+
+    def remove_cart_line(self, username, book_id, price_cents):
+        line = cart_line_attribute(book_id)
+        try:
+            response = self.carts_table.update_item(
+                Key={'username': username},
+                UpdateExpression='REMOVE #line ADD #version :one',
+                ExpressionAttributeNames={'#line': line, '#version': 'cart_version'},
+                ExpressionAttributeValues={':one': 1},
+                ReturnValues='UPDATED_OLD'
+            )
+            quantity = int(response.get('Attributes', {}).get(line, 0))
+        except ClientError as e:
+            logger.error(f"Error removing book {book_id} from cart for {username}: {e}")
+            return None
+
+        if quantity:
+            try:
+                self.carts_table.update_item(
+                    Key={'username': username},
+                    UpdateExpression='ADD #count :delta, #subtotal :cents',
+                    ExpressionAttributeNames={'#count': 'item_count', '#subtotal': 'subtotal_cents'},
+                    ExpressionAttributeValues={':delta': -quantity, ':cents': -quantity * price_cents}
+                )
+            except ClientError as e:
+                # Left for repair_cart_summary on the next full cart read
+                logger.error(f"Error updating cart summary for {username}: {e}")
+        return quantity
+
+    def create_order(self, order, expected_version):
+        """Write the order and empty the cart in one transaction.
+
+        Returns 'created', 'duplicate' if the order id already exists, 'cart_changed'
+        if the cart is no longer at expected_version, or None on error.
+        """
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+        condition, names, values = self._cart_condition(expected_version)
+        # The cart is emptied rather than deleted so its version keeps counting up
+        empty_cart = self._cart_item(order['username'], {}, expected_version + 1)
+
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {'Put': {
+                    'TableName': self.orders_table.name,
+                    'Item': {key: serializer.serialize(value) for key, value in order_to_item(order).items()},
+                    'ConditionExpression': 'attribute_not_exists(order_id)'
+                }},
+                {'Put': {
+                    'TableName': self.carts_table.name,
+                    'Item': {key: serializer.serialize(value) for key, value in empty_cart.items()},
+                    'ConditionExpression': condition,
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': {key: serializer.serialize(value) for key, value in values.items()}
+                }}
+            ])
+            return 'created'
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+                if reasons[:1] == ['ConditionalCheckFailed']:
+                    return 'duplicate'
+                if 'ConditionalCheckFailed' in reasons:
+                    return 'cart_changed'
+            logger.error(f"Error creating order {order['order_id']}: {e}")
+            return None
+
+    def get_order(self, order_id):
+        try:
+            response = self.orders_table.get_item(Key={'order_id': order_id}, ConsistentRead=True)
+        except ClientError as e:
+            logger.error(f"Error getting order {order_id}: {e}")
+            return None
+        item = response.get('Item')
+        return order_from_item(item) if item else None
+
+    def mark_order_notified(self, order_id):
+        try:
+            self.orders_table.update_item(
+                Key={'order_id': order_id},
+                UpdateExpression='SET notified_at = :now REMOVE outbox_pending',
+                ExpressionAttributeValues={':now': datetime.now(timezone.utc).isoformat()}
+            )
+            return True
+        except ClientError as e:
+            logger.error(f"Error marking order {order_id} as notified: {e}")
+            return False
+
+    def pending_order_ids(self, created_before):
+        """Ids of orders whose confirmation has not been sent, created before an ISO timestamp.
+
+        Queries the sparse outbox index, so the cost follows the pending orders, not every order ever placed.
+        """
+        query_args = {
+            'IndexName': ORDERS_OUTBOX_INDEX,
+            'KeyConditionExpression': 'outbox_pending = :pending AND created_at < :before',
+            'ProjectionExpression': 'order_id',
+            'ExpressionAttributeValues': {':pending': 1, ':before': created_before}
+        }
+        order_ids = []
+        while True:
+            response = self.orders_table.query(**query_args)
+            order_ids.extend(item['order_id'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return order_ids
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+class SQLiteDatabase:
+    """A SQLite database in WAL mode with one connection per thread, created with SCHEMA"""
+
+    SCHEMA = ""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        """Return this thread's connection, opening a new one after a fork"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block in an IMMEDIATE transaction on this thread's connection"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+class SQLiteStorage(SQLiteDatabase):
+    """User, cart and order storage in a local SQLite database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cart_lines (
+            username TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            PRIMARY KEY (username, book_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS cart_summaries (
+            username TEXT PRIMARY KEY,
+            item_count INTEGER NOT NULL,
+            subtotal_cents INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS cart_versions (
+            username TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            lines TEXT NOT NULL,
+            customer TEXT NOT NULL,
+            notification_subject TEXT,
+            notification_message TEXT,
+            outbox_pending INTEGER NOT NULL DEFAULT 0,
+            notified_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS orders_outbox ON orders (created_at) WHERE outbox_pending = 1;
+    """
+
+    @staticmethod
+    def _add_to_summary(connection, username, count, subtotal_cents):
+        connection.execute(
+            'INSERT INTO cart_summaries (username, item_count, subtotal_cents) VALUES (?, ?, ?) '
+            'ON CONFLICT (username) DO UPDATE SET item_count = item_count + excluded.item_count, '
+            'subtotal_cents = subtotal_cents + excluded.subtotal_cents',
+            (username, count, subtotal_cents)
+        )
+
+    @staticmethod
+    def _set_summary(connection, username, summary):
+        connection.execute(
+            'INSERT INTO cart_summaries (username, item_count, subtotal_cents) VALUES (?, ?, ?) '
+            'ON CONFLICT (username) DO UPDATE SET item_count = excluded.item_count, '
+            'subtotal_cents = excluded.subtotal_cents',
+            (username, summary['count'], summary['subtotal_cents'])
+        )
+
+    @staticmethod
+    def _summary_row(connection, username):
+        row = connection.execute(
+            'SELECT item_count, subtotal_cents FROM cart_summaries WHERE username = ?', (username,)
+        ).fetchone()
+        return {'count': row['item_count'], 'subtotal_cents': row['subtotal_cents']} if row else None
+
+    @staticmethod
+    def _version(connection, username):
+        row = connection.execute('SELECT version FROM cart_versions WHERE username = ?', (username,)).fetchone()
+        return row['version'] if row else 0
+
+    @staticmethod
+    def _bump_version(connection, username):
+        """Count a cart write; versions outlive the cart lines, so they never repeat"""
+        connection.execute(
+            'INSERT INTO cart_versions (username, version) VALUES (?, 1) '
+            'ON CONFLICT (username) DO UPDATE SET version = version + 1',
+            (username,)
+        )
+
+    @staticmethod
+    def _lines(connection, username):
+        rows = connection.execute(
+            'SELECT book_id, quantity FROM cart_lines WHERE username = ?', (username,)
+        ).fetchall()
+        return {row['book_id']: row['quantity'] for row in rows}
+
+    def get_user(self, username):
+        try:
+            row = self._connection().execute(
+                'SELECT username, password FROM users WHERE username = ?', (username,)
+            ).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting user {username}: {e}")
+            return None
+
+    def update_password(self, username, password, current_password):
+        """Replace a user's stored password if it still equals current_password"""
+        try:
+            cursor = self._connection().execute(
+                'UPDATE users SET password = ? WHERE username = ? AND password = ?',
+                (password, username, current_password)
+            )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Error updating password for {username}: {e}")
+            return False
+
+    def create_user(self, username, password):
+        try:
+            self._connection().execute(
+                'INSERT INTO users (username, password) VALUES (?, ?)', (username, password)
+            )
+            return True
+        except sqlite3.IntegrityError:
+            return False  # User already exists
+        except sqlite3.Error as e:
+            logger.error(f"Error creating user {username}: {e}")
+            return False
+
+    def get_cart(self, username):
+        """Read the cart as ({book_id: quantity}, version), or None on error; every cart write bumps the version"""
+        connection = self._connection()
+        try:
+            # The version is read first, so a write landing between the two reads fails the next conditional write
+            version = self._version(connection, username)
+            lines = self._lines(connection, username)
+            expected = cart_summary(lines)
+            stored = self._summary_row(connection, username)
+            if stored != expected and not (stored is None and expected == EMPTY_CART_SUMMARY):
+                with self._transaction() as connection:
+                    lines = self._lines(connection, username)
+                    self._set_summary(connection, username, cart_summary(lines))
+                logger.info(f"Repaired cart summary for {username}")
+            return lines, version
+        except sqlite3.Error as e:
+            logger.error(f"Error getting cart for {username}: {e}")
+            return None
+
+    def get_cart_lines(self, username):
+        cart = self.get_cart(username)
+        return cart[0] if cart is not None else None
+
+    def get_cart_summary(self, username):
+        """Read only the cart aggregates; carts without them are read in full and repaired"""
+        try:
+            summary = self._summary_row(self._connection(), username)
+        except sqlite3.Error as e:
+            logger.error(f"Error getting cart summary for {username}: {e}")
+            return None
+        if summary is not None:
+            return summary
+        lines = self.get_cart_lines(username)
+        return cart_summary(lines) if lines is not None else None
+
+    def replace_cart_lines(self, username, lines, expected_version):
+        """Write lines as the whole cart if it is still at expected_version.
+
+        Returns 'replaced', 'cart_changed' if the cart was modified since it was read, or None on error.
+        """
+        try:
+            with self._transaction() as connection:
+                if self._version(connection, username) != expected_version:
+                    return 'cart_changed'
+                self._write_lines(connection, username, lines)
+            return 'replaced'
+        except sqlite3.Error as e:
+            logger.error(f"Error replacing cart for {username}: {e}")
+            return None
+
+    def _write_lines(self, connection, username, lines):
+        connection.execute('DELETE FROM cart_lines WHERE username = ?', (username,))
+        connection.executemany(
+            'INSERT INTO cart_lines (username, book_id, quantity) VALUES (?, ?, ?)',
+            [(username, book_id, quantity) for book_id, quantity in lines.items()]
+        )
+        self._set_summary(connection, username, cart_summary(lines))
+        self._bump_version(connection, username)
+
+    @staticmethod
+    def _chunks(values, size=500):
+        """Split values for IN (...) queries, staying under SQLite's bound parameter limit"""
+        values = list(values)
+        return [values[start:start + size] for start in range(0, len(values), size)]
+
+    def existing_usernames(self, usernames):
+        """The subset of usernames that already have an account, or None on error"""
+        connection = self._connection()
+        found = set()
+        try:
+            for chunk in self._chunks(usernames):
+                rows = connection.execute(
+                    f"SELECT username FROM users WHERE username IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(row['username'] for row in rows)
+            return found
+        except sqlite3.Error as e:
+            logger.error(f"Error reading users: {e}")
+            return None
+
+    def put_users(self, users):
+        """Write user items ({'username', 'password'}), replacing any existing ones"""
+        users = list(users)
+        try:
+            with self._transaction() as connection:
+                connection.executemany(
+                    'INSERT INTO users (username, password) VALUES (?, ?) '
+                    'ON CONFLICT (username) DO UPDATE SET password = excluded.password',
+                    [(user['username'], user['password']) for user in users]
+                )
+            return {'written': len(users), 'retried': 0, 'failed': 0}
+        except sqlite3.Error as e:
+            logger.error(f"Error writing users: {e}")
+            return {'written': 0, 'retried': 0, 'failed': len(users)}
+
+    def get_carts(self, usernames):
+        """{username: (lines, version)} for the users that have a cart, or None on error"""
+        connection = self._connection()
+        carts = {}
+        try:
+            for chunk in self._chunks(usernames):
+                placeholders = ', '.join('?' * len(chunk))
+                for row in connection.execute(
+                        f"SELECT username, version FROM cart_versions WHERE username IN ({placeholders})", chunk):
+                    carts[row['username']] = ({}, row['version'])
+                for row in connection.execute(
+                        f"SELECT username, book_id, quantity FROM cart_lines WHERE username IN ({placeholders})", chunk):
+                    carts.setdefault(row['username'], ({}, 0))[0][row['book_id']] = row['quantity']
+            return carts
+        except sqlite3.Error as e:
+            logger.error(f"Error reading carts: {e}")
+            return None
+
+    def put_carts(self, carts):
+        """Write whole carts from {username: (lines, version read, or None if there was no cart)}.
+
+        Carts modified since they were read are left alone. Returns
+        {'written', 'retried', 'failed'} counts and the 'changed' usernames.
+        """
+        changed = []
+        try:
+            with self._transaction() as connection:
+                for username, (lines, version) in carts.items():
+                    if self._version(connection, username) != (version or 0):
+                        changed.append(username)
+                        continue
+                    self._write_lines(connection, username, lines)
+            return {'written': len(carts) - len(changed), 'retried': 0, 'failed': 0, 'changed': changed}
+        except sqlite3.Error as e:
+            logger.error(f"Error writing carts: {e}")
+            return {'written': 0, 'retried': 0, 'failed': len(carts), 'changed': []}
+
+    def change_cart_quantity(self, username, book_id, delta, price_cents):
+        try:
+            with self._transaction() as connection:
+                self._bump_version(connection, username)
+                if delta > 0:
+                    row = connection.execute(
+                        'INSERT INTO cart_lines (username, book_id, quantity) VALUES (?, ?, ?) '
+                        'ON CONFLICT (username, book_id) DO UPDATE SET quantity = quantity + excluded.quantity '
+                        'RETURNING quantity',
+                        (username, book_id, delta)
+                    ).fetchone()
+                else:
+                    row = connection.execute(
+                        'UPDATE cart_lines SET quantity = quantity + ? '
+                        'WHERE username = ? AND book_id = ? AND quantity > ? RETURNING quantity',
+                        (delta, username, book_id, -delta)
+                    ).fetchone()
+                if row:
+                    self._add_to_summary(connection, username, delta, delta * price_cents)
+                    return row['quantity']
+                self._delete_line(connection, username, book_id, price_cents)
+                return 0
+        except sqlite3.Error as e:
+            logger.error(f"Error updating cart for {username}: {e}")
+            return None
+
+    def remove_cart_line(self, username, book_id, price_cents):
+        try:
+            with self._transaction() as connection:
+                self._bump_version(connection, username)
+                return self._delete_line(connection, username, book_id, price_cents)
+        except sqlite3.Error as e:
+            logger.error(f"Error removing book {book_id} from cart for {username}: {e}")
+            return None
+
+    def _delete_line(self, connection, username, book_id, price_cents):
+        row = connection.execute(
+            'DELETE FROM cart_lines WHERE username = ? AND book_id = ? RETURNING quantity',
+            (username, book_id)
+        ).fetchone()
+        if not row:
+            return 0
+        self._add_to_summary(connection, username, -row['quantity'], -row['quantity'] * price_cents)
+        return row['quantity']
+
+    def create_order(self, order, expected_version):
+        """Write the order and delete the cart in one transaction.
+
+        Returns 'created', 'duplicate' if the order id already exists, 'cart_changed'
+        if the cart is no longer at expected_version, or None on error.
+        """
+        username = order['username']
+        notification = order['notification'] or {}
+        try:
+            with self._transaction() as connection:
+                if connection.execute('SELECT 1 FROM orders WHERE order_id = ?', (order['order_id'],)).fetchone():
+                    return 'duplicate'
+                if self._version(connection, username) != expected_version:
+                    return 'cart_changed'
+                connection.execute(
+                    'INSERT INTO orders (order_id, username, created_at, total_cents, lines, customer, '
+                    'notification_subject, notification_message, outbox_pending) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (order['order_id'], username, order['created_at'], order['total_cents'],
+                     json.dumps(order['lines']), json.dumps(order['customer']),
+                     notification.get('subject'), notification.get('message'), 1 if notification else 0)
+                )
+                connection.execute('DELETE FROM cart_lines WHERE username = ?', (username,))
+                connection.execute('DELETE FROM cart_summaries WHERE username = ?', (username,))
+                self._bump_version(connection, username)
+            return 'created'
+        except sqlite3.IntegrityError:
+            return 'duplicate'
+        except sqlite3.Error as e:
+            logger.error(f"Error creating order {order['order_id']}: {e}")
+            return None
+
+    def get_order(self, order_id):
+        try:
+            row = self._connection().execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting order {order_id}: {e}")
+            return None
+        if row is None:
+            return None
+        notification = None
+        if row['notification_subject'] is not None:
+            notification = {'subject': row['notification_subject'], 'message': row['notification_message']}
+        return {
+            'order_id': row['order_id'],
+            'username': row['username'],
+            'created_at': row['created_at'],
+            'total_cents': row['total_cents'],
+            'lines': json.loads(row['lines']),
+            'customer': json.loads(row['customer']),
+            'notification': notification,
+            'notification_pending': bool(row['outbox_pending'])
+        }
+
+    def mark_order_notified(self, order_id):
+        try:
+            self._connection().execute(
+                'UPDATE orders SET outbox_pending = 0, notified_at = ? WHERE order_id = ?',
+                (datetime.now(timezone.utc).isoformat(), order_id)
+            )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error marking order {order_id} as notified: {e}")
+            return False
+
+    def pending_order_ids(self, created_before):
+        """Ids of orders whose confirmation has not been sent, created before an ISO timestamp"""
+        rows = self._connection().execute(
+            'SELECT order_id FROM orders WHERE outbox_pending = 1 AND created_at < ?', (created_before,)
+        ).fetchall()
+        return [row['order_id'] for row in rows]
+
+def create_storage(backend=STORAGE_BACKEND):
+    """Create the storage backend selected by STORAGE_BACKEND"""
+    if backend == 'dynamodb':
+        return DynamoDBStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+storage = create_storage()
+
+class MemorySessionStore:
+    """Per-process LRU session store with a TTL (sliding by default) and a size bound"""
+
+    def __init__(self, max_size=SESSION_CACHE_SIZE, ttl=SESSION_TTL, sliding=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sliding = sliding
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # sid -> (expires, username, JSON data)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        """Return the session data, or None if it is unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[sid]
+                self.misses += 1
+                return None
+            if self.sliding:
+                self._entries[sid] = (time.monotonic() + self.ttl, entry[1], entry[2])
+            self._entries.move_to_end(sid)
+            self.hits += 1
+        return json.loads(entry[2])
+
+    def save(self, sid, data, username=None):
+        payload = json.dumps(data)
+        with self._lock:
+            self._entries[sid] = (time.monotonic() + self.ttl, username, payload)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def delete_user(self, username):
+        """Drop every session of a user"""
+        with self._lock:
+            for sid in [sid for sid, entry in self._entries.items() if entry[1] == username]:
+                del self._entries[sid]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+class SQLiteSessionStore(SQLiteDatabase):
+    """Sessions in a SQLite table shared by every process on the host, behind a short per-process cache.
+
+    A session deleted in one process can be served from another process's
+    cache for up to SESSION_LOCAL_CACHE_TTL seconds.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            username TEXT,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username);
+        CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+    """
+
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, path=SESSION_SQLITE_PATH, ttl=SESSION_TTL, cache_ttl=SESSION_LOCAL_CACHE_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+        self.cache = MemorySessionStore(ttl=cache_ttl, sliding=False)
+        self._next_purge = 0.0
+
+    def load(self, sid):
+        data = self.cache.load(sid)
+        if data is not None:
+            return data
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                'SELECT username, data, expires FROM sessions WHERE sid = ? AND expires > ?', (sid, now)
+            ).fetchone()
+            if row is None:
+                return None
+            if row['expires'] - now < self.ttl / 2:
+                # Slide the expiry at most a couple of times per TTL rather than on every request
+                connection.execute('UPDATE sessions SET expires = ? WHERE sid = ?', (now + self.ttl, sid))
+        except sqlite3.Error as e:
+            logger.error(f"Error loading session: {e}")
+            return None
+        data = json.loads(row['data'])
+        self.cache.save(sid, data, row['username'])
+        return data
+
+    def save(self, sid, data, username=None):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions (sid, username, data, expires) VALUES (?, ?, ?, ?)',
+                (sid, username, json.dumps(data), now + self.ttl)
+            )
+            if now >= self._next_purge:
+                self._next_purge = now + self.PURGE_INTERVAL
+                connection.execute('DELETE FROM sessions WHERE expires <= ?', (now,))
+        except sqlite3.Error as e:
+            logger.error(f"Error saving session: {e}")
+        self.cache.save(sid, data, username)
+
+    def delete(self, sid):
+        self.cache.delete(sid)
+        try:
+            self._connection().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting session: {e}")
+
+    def delete_user(self, username):
+        """Drop every session of a user"""
+        self.cache.delete_user(username)
+        try:
+            self._connection().execute('DELETE FROM sessions WHERE username = ?', (username,))
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting sessions of {username}: {e}")
+
+    def stats(self):
+        return self.cache.stats()
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data held in a server-side store and referenced by an opaque id cookie"""
+
+    server_side = True
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.opened_username = self.get('username')
+        self.modified = False
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface storing session data server-side; the cookie only carries a random id"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_RE.fullmatch(sid):
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if not session.modified:
+            return
+        if session.sid is not None and (not session or session.get('username') != session.opened_username):
+            # Logged out, or logged in as someone else: retire the old id
+            self.store.delete(session.sid)
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                return
+            session.sid = None
+        if not session:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, dict(session), session.get('username'))
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+        response.vary.add('Cookie')
+
+def create_session_interface(backend=SESSION_STORE):
+    """Create the session interface selected by SESSION_STORE (None keeps Flask's signed cookies)"""
+    if backend == 'cookie':
+        return None
+    if backend == 'memory':
+        return ServerSideSessionInterface(MemorySessionStore())
+    if backend == 'sqlite':
+        return ServerSideSessionInterface(SQLiteSessionStore(SESSION_SQLITE_PATH))
+    raise ValueError(f"Unknown session store: {backend}")
+
+if SESSION_STORE != 'cookie':
+    app.session_interface = create_session_interface(SESSION_STORE)
+
+def revoke_user_sessions(username):
+    """Log a user out everywhere (server-side session stores only); returns False if unsupported"""
+    store = getattr(app.session_interface, 'store', None)
+    if store is None:
+        return False
+    store.delete_user(username)
+    return True
+
+def fresh_session_cart_summary(session_data):
+    """The cart summary cached in a session, or None if there is none or it has expired"""
+    slot = session_data.get('_cart_summary')
+    if slot and slot['expires'] > time.time():
+        return slot['summary']
+    return None
+
+def session_cart_summary(username):
+    """Cart summary for the logged-in user, cached in the server-side session between cart changes"""
+    if not getattr(session, 'server_side', False):
+        return get_cart_summary(username)
+    summary = fresh_session_cart_summary(session)
+    if summary is None:
+        summary = get_cart_summary(username)
+        session['_cart_summary'] = {'summary': summary, 'expires': time.time() + SESSION_CART_SUMMARY_TTL}
+    return summary
+
+def forget_session_cart_summary(username):
+    """Drop the session's cached cart summary after the user's cart changes in this request"""
+    if has_request_context() and session.get('username') == username and '_cart_summary' in session:
+        session.pop('_cart_summary')
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashes are already queued, or one does not finish in time"""
 
+class PasswordHasher:
+    """Hashes and verifies passwords with scrypt or PBKDF2 on a bounded thread pool.
+
+    hashlib releases the GIL while it runs the KDF, so the pool scales across
+    cores without blocking request threads on each other. Once max_pending
+    hashes are queued or running, new requests are rejected with
+    PasswordHasherBusy instead of waiting behind the queue.
+    """
+
+    # Upper bounds on parameters accepted from imported hashes (scrypt uses 128 * n * r bytes)
+    SCRYPT_MAX_N = 2 ** 20
+    SCRYPT_MAX_R = 16
+    SCRYPT_MAX_P = 16
+    PBKDF2_MAX_ITERATIONS = 10_000_000
+
+    def __init__(self, algorithm=PASSWORD_HASH_ALGORITHM, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        if algorithm not in ('scrypt', 'pbkdf2_sha256'):
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.counters = {'hashed': 0, 'rejected': 0}
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Verified against when the user does not exist, so unknown usernames take as long as wrong passwords
+        self._dummy_hash = None
+
+    def _params(self):
+        if self.algorithm == 'scrypt':
+            return (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+        return (PASSWORD_PBKDF2_ITERATIONS,)
+
+    @staticmethod
+    def _derive(algorithm, params, password, salt):
+        if algorithm == 'scrypt':
+            n, r, p = params
+            return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p)
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params[0])
+
+    @staticmethod
+    def _parse(stored):
+        """Split a stored hash into (algorithm, params, salt, digest), or None for a legacy plaintext password"""
+        parts = stored.split('$')
+        try:
+            if parts[0] == 'scrypt' and len(parts) == 6:
+                params = tuple(int(value) for value in parts[1:4])
+            elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+                params = (int(parts[1]),)
+            else:
+                return None
+            return parts[0], params, base64.b64decode(parts[-2]), base64.b64decode(parts[-1])
+        except ValueError:
+            return None
+
+    def is_valid_hash(self, stored):
+        """True if stored is a hash this hasher can verify with bounded memory and time"""
+        parsed = self._parse(stored) if isinstance(stored, str) else None
+        if parsed is None:
+            return False
+        algorithm, params, salt, digest = parsed
+        if not salt:
+            return False
+        if algorithm == 'scrypt':
+            n, r, p = params
+            return (2 <= n <= self.SCRYPT_MAX_N and n & (n - 1) == 0 and 1 <= r <= self.SCRYPT_MAX_R
+                    and 1 <= p <= self.SCRYPT_MAX_P and len(digest) == 64)
+        return 1 <= params[0] <= self.PBKDF2_MAX_ITERATIONS and len(digest) == hashlib.sha256().digest_size
+
+    def _run(self, func, *args):
+        """Run func on the pool; raises PasswordHasherBusy if max_pending hashes are in flight or it times out"""
+        if not self._slots.acquire(blocking=False):
+            self.counters['rejected'] += 1
+            raise PasswordHasherBusy()
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+                    self._pid = os.getpid()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self.counters['hashed'] += 1
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            # The hash keeps its slot until it finishes, so a backed-up pool sheds new requests
+            self.counters['rejected'] += 1
+            raise PasswordHasherBusy()
+
+    def _encode(self, password):
+        salt = os.urandom(16)
+        params = self._params()
+        digest = self._derive(self.algorithm, params, password, salt)
+        fields = [self.algorithm, *map(str, params), base64.b64encode(salt).decode(), base64.b64encode(digest).decode()]
+        return '$'.join(fields)
+
+    def hash(self, password):
+        """Return the stored form of a password"""
+        return self._run(self._encode, password)
+
+    def verify(self, password, stored):
+        """Check a password against its stored form (a hash, or a legacy plaintext password)"""
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self._encode(secrets.token_hex(8))
+            self.verify(password, self._dummy_hash)
+            return False
+        parsed = self._parse(stored)
+        if parsed is None:
+            return hmac.compare_digest(password.encode(), stored.encode())
+        algorithm, params, salt, digest = parsed
+        try:
+            derived = self._run(self._derive, algorithm, params, password, salt)
+        except ValueError as e:
+            logger.warning(f"Stored password hash could not be verified: {e}")
+            return False
+        return hmac.compare_digest(derived, digest)
+
+    def needs_rehash(self, stored):
+        """True for legacy plaintext passwords and hashes made with other parameters"""
+        parsed = self._parse(stored)
+        return parsed is None or parsed[0] != self.algorithm or parsed[1] != self._params()
+
+    def stats(self):
+        return dict(self.counters)
+
+password_hasher = PasswordHasher()
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'get_user_from_db')
 def get_user_from_db(username):
-    """Get user from DynamoDB"""
-    try:
-        response = users_table.get_item(Key={'username': username})
-        return response.get('Item')
-    except ClientError as e:
-        logger.error(f"Error getting user {username}: {e}")
-        return None
+    """Get user from the storage backend"""
+    return storage.get_user(username)
 
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'create_user_in_db')
 def create_user_in_db(username, password):
-    """Create user in DynamoDB"""
-    try:
-        users_table.put_item(
-            Item={
-                'username': username,
-                'password': password
-            },
-            ConditionExpression='attribute_not_exists(username)'
-        )
-        return True
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-            return False  # User already exists
-        logger.error(f"Error creating user {username}: {e}")
+    """Hash the password and create the user in the storage backend (may raise PasswordHasherBusy)"""
+    return storage.create_user(username, password_hasher.hash(password))
+
+def import_accounts(rows, overwrite=False, hash_workers=PASSWORD_HASH_WORKERS):
+    """Bulk-write one chunk of account rows: {'username', 'password' or 'password_hash', 'cart': {book_id: qty}}.
+
+    Existing users are skipped unless overwrite is set, and imported carts
+    are added to any cart the user already has, re-reading carts that change
+    before the write. Running workers pick up merged carts once their cart
+    cache entries expire (CART_CACHE_TTL). Rows whose password_hash is
+    not in a format PasswordHasher verifies are rejected as invalid: stored
+    as is, it would be checked as a plaintext password. Returns a Counter of
+    users/carts written, skipped and failed, and unprocessed items retried.
+    """
+    counts = Counter()
+    accounts = {}
+    for row in rows:
+        username = row.get('username') if isinstance(row, dict) else None
+        if not isinstance(username, str) or not username:
+            counts['invalid'] += 1
+            continue
+        if 'password_hash' in row and not password_hasher.is_valid_hash(row['password_hash']):
+            counts['invalid'] += 1
+            continue
+        accounts[username] = row
+
+    users = [row for row in accounts.values()
+             if isinstance(row.get('password_hash', row.get('password')), str)]
+    if users and not overwrite:
+        existing = storage.existing_usernames([row['username'] for row in users])
+        if existing is None:
+            counts['users_failed'] += len(users)
+            users = []
+        else:
+            counts['users_skipped'] += sum(1 for row in users if row['username'] in existing)
+            users = [row for row in users if row['username'] not in existing]
+    if users:
+        plaintext = [row['password'] for row in users if 'password_hash' not in row]
+        with ThreadPoolExecutor(max_workers=hash_workers) as pool:
+            hashes = iter(list(pool.map(password_hasher.hash, plaintext)))
+        items = [{'username': row['username'],
+                  'password': row['password_hash'] if 'password_hash' in row else next(hashes)}
+                 for row in users]
+        result = storage.put_users(items)
+        counts['users_written'] += result['written']
+        counts['users_failed'] += result['failed']
+        counts['retried'] += result['retried']
+
+    imported = {}
+    for username, row in accounts.items():
+        if not isinstance(row.get('cart'), dict):
+            continue
+        imported[username] = {}
+        for book_id, quantity in row['cart'].items():
+            try:
+                book_id, quantity = int(book_id), int(quantity)
+            except (TypeError, ValueError):
+                book_id = quantity = None
+            if book_id not in catalog.price_cents or quantity is None or quantity <= 0:
+                counts['cart_lines_skipped'] += 1
+                continue
+            imported[username][book_id] = imported[username].get(book_id, 0) + quantity
+
+    # Carts edited between the read and the write are re-read and merged again
+    pending = imported
+    for _ in range(CART_BATCH_RETRIES):
+        if not pending:
+            break
+        existing_carts = storage.get_carts(list(pending))
+        if existing_carts is None:
+            break
+        merged = {}
+        for username, cart in pending.items():
+            lines, version = existing_carts.get(username, ({}, None))
+            lines = dict(lines)
+            for book_id, quantity in cart.items():
+                lines[book_id] = lines.get(book_id, 0) + quantity
+            merged[username] = (lines, version)
+        result = storage.put_carts(merged)
+        counts['carts_written'] += result['written']
+        counts['carts_failed'] += result['failed']
+        counts['retried'] += result['retried']
+        for username in merged:
+            cart_cache.invalidate(username)
+        pending = {username: pending[username] for username in result['changed']}
+    counts['carts_failed'] += len(pending)
+    return counts
+
+def authenticate_user(username, password):
+    """Return True if the password is correct, rehashing legacy or outdated hashes (may raise PasswordHasherBusy)"""
+    user = get_user_from_db(username)
+    stored = user.get('password') if user else None
+    if not password_hasher.verify(password, stored):
         return False
+    if password_hasher.needs_rehash(stored):
+        try:
+            if storage.update_password(username, password_hasher.hash(password), stored):
+                logger.info(f"Rehashed password for {username}")
+        except PasswordHasherBusy:
+            pass  # Rehashed on a later login
+    return True
+
+def hydrate_cart(lines):
+    """Build cart items for the templates from {book_id: quantity} and the catalog"""
+    cart_items = []
+    for book_id in sorted(lines):
+        book = catalog.get(book_id)
+        if book is None:
+            continue
+        cart_item = dict(book)
+        cart_item['quantity'] = lines[book_id]
+        cart_item['price_cents'] = catalog.price_cents[book_id]
+        cart_items.append(cart_item)
+    return cart_items
+
+def get_user_cart_lines(username):
+    """Get user's cart as {book_id: quantity}, served from the cart cache when possible"""
+    cached = cart_cache.get(username)
+    if cached is not None:
+        return cached
+
+    lines = storage.get_cart_lines(username)
+    if lines is None:
+        return {}
+    cart_cache.set(username, lines)
+    return lines
+
+def get_user_cart_for_update(username):
+    """Read the cart and its version from storage, bypassing the cart cache, ahead of a conditional write.
+
+    Returns (lines, version), or None on error.
+    """
+    cart = storage.get_cart(username)
+    if cart is not None:
+        cart_cache.set(username, cart[0])
+    return cart
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'get_cart_summary')
+def get_cart_summary(username):
+    """Item count and subtotal of the user's cart, without reading or hydrating its lines"""
+    cached = cart_cache.get(username)
+    if cached is not None:
+        return cart_summary(cached)
+    summary = storage.get_cart_summary(username)
+    return summary if summary is not None else dict(EMPTY_CART_SUMMARY)
+
+def get_cart_count(username):
+    """Number of books in the user's cart"""
+    return get_cart_summary(username)['count']
 
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'get_user_cart')
 def get_user_cart(username):
-    """Get user's cart from DynamoDB"""
-    try:
-        response = carts_table.get_item(Key={'username': username})
-        if 'Item' in response:
-            cart_data = response['Item']
-            return decimal_to_float(cart_data.get('items', []))
-        return []
-    except ClientError as e:
-        logger.error(f"Error getting cart for {username}: {e}")
-        return []
+    """Get user's cart items, hydrated from the catalog"""
+    return hydrate_cart(get_user_cart_lines(username))
 
-def update_user_cart(username, cart_items):
-    """Update user's cart in DynamoDB"""
-    try:
-        # Convert floats to Decimal for DynamoDB
-        decimal_items = json.loads(json.dumps(cart_items), parse_float=Decimal)
-        
-        carts_table.put_item(
-            Item={
-                'username': username,
-                'items': decimal_items
-            }
-        )
-        return True
-    except ClientError as e:
-        logger.error(f"Error updating cart for {username}: {e}")
-        return False
+CART_OPERATIONS = ('add', 'set', 'remove', 'clear')
 
-def send_notification(subject, message):
-    """Send SNS notification"""
+def parse_cart_operations(operations):
+    """Validate a JSON list of cart operations into (op, book_id, quantity) tuples (raises ValueError)"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('operations must be a non-empty list')
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        raise ValueError(f'At most {CART_BATCH_MAX_OPERATIONS} operations per batch')
+    parsed = []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in CART_OPERATIONS:
+            raise ValueError(f"Operation {index}: op must be one of {', '.join(CART_OPERATIONS)}")
+        if op == 'clear':
+            parsed.append((op, None, 0))
+            continue
+        book_id = operation.get('book_id')
+        quantity = operation.get('quantity', 1 if op == 'add' else 0)
+        for name, value in (('book_id', book_id), ('quantity', quantity)):
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f'Operation {index}: {name} must be an integer')
+        if op == 'set' and quantity < 0:
+            raise ValueError(f'Operation {index}: quantity cannot be negative')
+        if op == 'add' and quantity < 1:
+            raise ValueError(f'Operation {index}: add quantity must be at least 1')
+        if op != 'remove' and book_id not in catalog.price_cents:
+            raise ValueError(f'Operation {index}: book {book_id} not found')
+        parsed.append((op, book_id, quantity))
+    return parsed
+
+def apply_cart_operations(lines, operations):
+    """Return a copy of {book_id: quantity} with parsed operations applied in order"""
+    lines = dict(lines)
+    for op, book_id, quantity in operations:
+        if op == 'clear':
+            lines.clear()
+            continue
+        if op == 'add':
+            quantity += lines.get(book_id, 0)
+        elif op == 'remove':
+            quantity = 0
+        if quantity > 0:
+            lines[book_id] = quantity
+        else:
+            lines.pop(book_id, None)
+    return lines
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'apply_cart_batch')
+def apply_cart_batch(username, operations):
+    """Apply parsed cart operations with a single conditional cart write.
+
+    If the cart changes between the read and the write, it is re-read and
+    the operations re-applied, up to CART_BATCH_RETRIES times. Returns the
+    new lines, or None on error or continued contention.
+    """
+    forget_session_cart_summary(username)
+    for _ in range(CART_BATCH_RETRIES):
+        cart = storage.get_cart(username)
+        if cart is None:
+            break
+        lines, version = cart
+        updated = apply_cart_operations(lines, operations)
+        status = 'replaced' if updated == lines else storage.replace_cart_lines(username, updated, version)
+        if status == 'replaced':
+            cart_cache.set(username, updated)
+            return updated
+        if status is None:
+            break
+    cart_cache.invalidate(username)
+    return None
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'change_cart_quantity')
+def change_cart_quantity(username, book_id, delta):
+    """Atomically add delta to a book's quantity in the cart.
+
+    Returns the new quantity, 0 if a decrease removed the book, or None on error.
+    A decrease never takes a line below 1; the line is removed instead.
+    """
+    forget_session_cart_summary(username)
+    quantity = storage.change_cart_quantity(username, book_id, delta, catalog.price_cents.get(book_id, 0))
+    if quantity is None:
+        cart_cache.invalidate(username)
+    else:
+        cart_cache.set_line(username, book_id, quantity)
+    return quantity
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'remove_cart_item')
+def remove_cart_item(username, book_id):
+    """Atomically remove a book from the cart; returns its old quantity (0 if absent) or None on error"""
+    forget_session_cart_summary(username)
+    quantity = storage.remove_cart_line(username, book_id, catalog.price_cents.get(book_id, 0))
+    if quantity is None:
+        cart_cache.invalidate(username)
+    else:
+        cart_cache.set_line(username, book_id, 0)
+    return quantity
+
+def new_order(order_id, username, cart_items, customer_info):
+    """Build an order from hydrated cart items, with its confirmation notification for the outbox"""
+    total_cents = cart_total_cents(cart_items)
+    notification = build_order_confirmation_notification(
+        username, cart_items, customer_info, cents_to_amount(total_cents)
+    )
+    return {
+        'order_id': order_id,
+        'username': username,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'total_cents': total_cents,
+        'lines': [
+            {'id': item['id'], 'quantity': item['quantity'], 'price_cents': item['price_cents']}
+            for item in cart_items
+        ],
+        'customer': customer_info,
+        'notification': {'subject': notification[0], 'message': notification[1]} if notification else None
+    }
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'create_order')
+def create_order(order, expected_version):
+    """Record the order and clear the cart in one conditional write; see the storage create_order"""
+    forget_session_cart_summary(order['username'])
+    status = storage.create_order(order, expected_version)
+    if status == 'created':
+        cart_cache.set(order['username'], {})
+    elif status != 'duplicate':
+        cart_cache.invalidate(order['username'])
+    return status
+
+@DEPENDENCY_LATENCY.time(STORAGE_BACKEND, 'get_order')
+def get_order(order_id):
+    """Get an order by id, or None if it does not exist (or on error)"""
+    return storage.get_order(order_id)
+
+@DEPENDENCY_LATENCY.time('sns', 'publish')
+def publish_notification(subject, message, attributes=None):
+    """Publish a notification to SNS (called from the dispatcher and outbox workers); returns True if sent"""
+    extra = {'MessageAttributes': attributes} if attributes else {}
     try:
-        sns.publish(
+        ConcurrencyLimited(aws.client('sns'), dependency_limiters['sns']).publish(
             TopicArn=SNS_TOPIC_ARN,
             Subject=subject,
-            Message=message
+            Message=message,
+            **extra
         )
         logger.info(f"Notification sent: {subject}")
+        return True
     except ClientError as e:
         logger.error(f"Error sending notification: {e}")
+        return False
+
+class NotificationDispatcher:
+    """Publishes notifications from a bounded queue on background worker threads"""
+
+    _STOP = object()
+
+    def __init__(self, publish, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 debounce_seconds=NOTIFY_DEBOUNCE_SECONDS, overflow_policy=NOTIFY_OVERFLOW_POLICY,
+                 block_timeout=NOTIFY_BLOCK_TIMEOUT):
+        if overflow_policy not in ('drop_oldest', 'drop_newest', 'block'):
+            raise ValueError(f"Unknown notification overflow policy: {overflow_policy}")
+        self.publish = publish
+        self.workers = workers
+        self.debounce_seconds = debounce_seconds
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.counters = {'submitted': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'coalesced': 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}
+        self._pending_cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the worker threads on first use (and again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = [threading.Thread(target=self._worker, name=f'notify-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._debounce_loop, name='notify-debounce', daemon=True))
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, subject, message):
+        """Queue a notification; returns False if it was dropped"""
+        if self._closed:
+            return False
+        self._ensure_started()
+        self.counters['submitted'] += 1
+        return self._enqueue((subject, message))
+
+    def submit_debounced(self, key, build):
+        """Queue build() to run once per debounce window for the given key.
+
+        Later submissions for the same key replace the pending one, so rapid
+        updates are coalesced into a single notification. build() returns a
+        (subject, message) tuple, or None to send nothing.
+        """
+        if self._closed:
+            return
+        self._ensure_started()
+        with self._pending_cond:
+            self.counters['submitted'] += 1
+            if key in self._pending:
+                self._pending[key][1] = build
+                self.counters['coalesced'] += 1
+            else:
+                self._pending[key] = [time.monotonic() + self.debounce_seconds, build]
+                self._pending_cond.notify()
+
+    def _enqueue(self, notification):
+        """Put a notification on the queue, applying the overflow policy when full"""
+        try:
+            self._queue.put_nowait(notification)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == 'block':
+            try:
+                self._queue.put(notification, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                pass
+        elif self.overflow_policy == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self.counters['dropped'] += 1
+                self._queue.put_nowait(notification)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        self.counters['dropped'] += 1
+        logger.warning(f"Notification queue full, dropped: {notification[0]}")
+        return False
+
+    def _take_due(self, flush_all=False):
+        """Remove and return the builders whose debounce window has elapsed"""
+        now = time.monotonic()
+        due_keys = [key for key, (deadline, _) in self._pending.items() if flush_all or deadline <= now]
+        return [self._pending.pop(key)[1] for key in due_keys]
+
+    def _run_builders(self, builders):
+        for build in builders:
+            try:
+                notification = build()
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.error(f"Error building notification: {e}")
+                continue
+            if notification:
+                self._enqueue(notification)
+
+    def _debounce_loop(self):
+        while True:
+            with self._pending_cond:
+                while not self._pending and not self._closed:
+                    self._pending_cond.wait()
+                if self._closed:
+                    return
+                timeout = min(deadline for deadline, _ in self._pending.values()) - time.monotonic()
+                if timeout > 0:
+                    self._pending_cond.wait(timeout)
+                builders = self._take_due()
+            self._run_builders(builders)
+
+    def _worker(self):
+        while True:
+            notification = self._queue.get()
+            try:
+                if notification is self._STOP:
+                    return
+                # publish logs its own errors and returns False
+                if self.publish(*notification):
+                    self.counters['sent'] += 1
+                else:
+                    self.counters['failed'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.error(f"Error publishing notification: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=10.0):
+        """Send all pending debounced notifications and wait for the queue to drain"""
+        with self._pending_cond:
+            builders = self._take_due(flush_all=True)
+        self._run_builders(builders)
+
+        if self._pid != os.getpid():
+            return self._queue.unfinished_tasks == 0
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=10.0):
+        """Flush outstanding notifications and stop the worker threads"""
+        if self._closed:
+            return
+        drained = self.flush(timeout)
+        if not drained:
+            logger.warning("Notification queue not drained before shutdown")
+        with self._pending_cond:
+            self._closed = True
+            self._pending_cond.notify_all()
+        if self._pid == os.getpid():
+            for _ in range(self.workers):
+                self._queue.put(self._STOP)
+            for thread in self._threads:
+                thread.join(timeout)
+
+    def stats(self):
+        """Return dispatcher counters and the current queue depth"""
+        with self._pending_cond:
+            pending = len(self._pending)
+        return dict(self.counters, queued=self._queue.qsize(), pending=pending)
+
+notifier = NotificationDispatcher(publish_notification)
+atexit.register(notifier.shutdown)
+
+class OrderOutbox:
+    """Publishes the confirmation stored with each order on a background thread, retrying until sent.
+
+    Orders are scheduled when they are placed. A periodic sweep also picks up
+    orders left pending by earlier failures or by a process that exited, so a
+    confirmation is sent at least once.
+    """
 
-def send_order_confirmation_notification(username, cart_items, customer_info, total_amount):
-    """Send detailed order confirmation notification"""
+    def __init__(self, publish, max_attempts=OUTBOX_MAX_ATTEMPTS, retry_delay=OUTBOX_RETRY_DELAY,
+                 sweep_interval=OUTBOX_SWEEP_INTERVAL):
+        self.publish = publish
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.sweep_interval = sweep_interval
+        self.counters = {'scheduled': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+        self._schedule = []  # heap of (due, attempt, order_id)
+        self._scheduled = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._next_sweep = 0.0
+
+    def start(self):
+        """Start the worker thread (on first use, and again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._schedule = []
+            self._scheduled = set()
+            self._next_sweep = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='order-outbox', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def schedule(self, order_id, delay=0.0, attempt=0):
+        """Schedule the confirmation of an order"""
+        if self._closed:
+            return
+        self.start()
+        with self._cond:
+            if attempt == 0:
+                if order_id in self._scheduled:
+                    return
+                self.counters['scheduled'] += 1
+            self._scheduled.add(order_id)
+            heapq.heappush(self._schedule, (time.monotonic() + delay, attempt, order_id))
+            self._cond.notify()
+
+    def _next_due(self):
+        """Wait until an order is due or a sweep is due; returns the order entry, None to sweep, or False to stop"""
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                if self._schedule and self._schedule[0][0] <= now:
+                    return heapq.heappop(self._schedule)
+                if self.sweep_interval > 0 and self._next_sweep <= now:
+                    self._next_sweep = now + self.sweep_interval
+                    return None
+                wake_at = self._schedule[0][0] if self._schedule else math.inf
+                if self.sweep_interval > 0:
+                    wake_at = min(wake_at, self._next_sweep)
+                self._cond.wait(None if wake_at == math.inf else wake_at - now)
+            return False
+
+    def _run(self):
+        while True:
+            entry = self._next_due()
+            if entry is False:
+                return
+            if entry is None:
+                self._sweep()
+            else:
+                self._deliver(entry[2], entry[1])
+
+    def _sweep(self):
+        cutoff = datetime.fromtimestamp(time.time() - self.sweep_interval, timezone.utc).isoformat()
+        try:
+            order_ids = storage.pending_order_ids(cutoff)
+        except Exception as e:
+            logger.error(f"Error sweeping the order outbox: {e}")
+            return
+        for order_id in order_ids:
+            self.schedule(order_id)
+
+    def _deliver(self, order_id, attempt):
+        sent = False
+        try:
+            order = get_order(order_id)
+            if order is not None and not order['notification_pending']:
+                sent = True  # Already sent (e.g. by another process)
+            elif order is not None:
+                notification = order['notification']
+                if self.publish(notification['subject'], notification['message'], order_notification_attributes(order)):
+                    storage.mark_order_notified(order_id)
+                    self.counters['sent'] += 1
+                    sent = True
+        except Exception as e:
+            logger.error(f"Error delivering confirmation for order {order_id}: {e}")
+
+        if sent:
+            with self._cond:
+                self._scheduled.discard(order_id)
+        elif attempt + 1 < self.max_attempts:
+            self.counters['retried'] += 1
+            self.schedule(order_id, self.retry_delay * 2 ** attempt, attempt + 1)
+        else:
+            self.counters['failed'] += 1
+            logger.error(f"Giving up on confirmation for order {order_id} after {self.max_attempts} attempts")
+            with self._cond:
+                self._scheduled.discard(order_id)
+
+    def shutdown(self, timeout=10.0):
+        """Stop the worker; unsent confirmations stay pending for the next sweep"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._pid == os.getpid() and self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Return outbox counters and the number of scheduled confirmations"""
+        with self._cond:
+            return dict(self.counters, pending=len(self._scheduled))
+
+order_outbox = OrderOutbox(publish_notification)
+atexit.register(order_outbox.shutdown)
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='io')
+# Only touched from the event loop thread, so no lock is needed
+io_counters = {'calls': 0, 'rejected': 0, 'pending': 0}
+
+def call_shedding_overload(func, *args):
+    with shedding_overload():
+        return func(*args)
+
+async def run_io(func, *args):
+    """Run a blocking storage or AWS call for a request on the I/O pool without blocking the event loop.
+
+    Raises DependencyOverloaded once IO_MAX_PENDING calls are queued or
+    running, or when a dependency the call uses is overloaded, so overload
+    surfaces as a fast 503 rather than a growing queue.
+    """
+    if io_counters['pending'] >= IO_MAX_PENDING:
+        io_counters['rejected'] += 1
+        raise DependencyOverloaded('io')
+    io_counters['pending'] += 1
+    io_counters['calls'] += 1
     try:
-        # Generate order timestamp
-        order_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Build detailed notification message
-        message = f"""
+        return await asyncio.get_running_loop().run_in_executor(io_executor, call_shedding_overload, func, *args)
+    finally:
+        io_counters['pending'] -= 1
+
+def send_notification(subject, message):
+    """Queue an SNS notification for background delivery"""
+    notifier.submit(subject, message)
+
+# Notification templates: f-string renderers compiled once at import; a message is the header,
+# one rendered line per item and the footer, joined in a single pass
+NOTIFICATION_RULE = '━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━'
+
+def render_order_confirmation_header(username, customer_info, order_time):
+    return f"""
 📚 BOOK ORDER CONFIRMED - BookBazar 📚
 
 🎉 Order Details:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{NOTIFICATION_RULE}
 📅 Order Date: {order_time}
 👤 Customer: {customer_info['name']}
 📧 Email: {customer_info['email']}
@@ -172,28 +3330,23 @@ def send_order_confirmation_notification(username, cart_items, customer_info, to
 👤 Username: {username}
 
 📖 BOOKS ORDERED:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
+{NOTIFICATION_RULE}"""
 
-        total_books = 0
-        for item in cart_items:
-            quantity = item.get('quantity', 1)
-            price = item.get('price', 0)
-            item_total = quantity * price
-            total_books += quantity
-            
-            message += f"""
+def render_order_confirmation_line(item, quantity, price_cents):
+    return f"""
 📚 {item.get('title', 'Unknown Title')}
    ✍️  Author: {item.get('author', 'Unknown Author')}
-   💰 Price: ${price:.2f}
+   💰 Price: ${price_cents / 100:.2f}
    📦 Quantity: {quantity}
-   💵 Subtotal: ${item_total:.2f}
+   💵 Subtotal: ${quantity * price_cents / 100:.2f}
    📝 Description: {item.get('description', 'No description available')[:50]}...
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
+   {NOTIFICATION_RULE}"""
 
-        message += f"""
+def render_order_confirmation_footer(total_books, total_amount):
+    return f"""
 
 💰 ORDER SUMMARY:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{NOTIFICATION_RULE}
 📚 Total Books: {total_books}
 💵 Total Amount: ${total_amount:.2f}
 
@@ -203,76 +3356,273 @@ def send_order_confirmation_notification(username, cart_items, customer_info, to
 Thank you for shopping with BookBazar! 📚✨
 """
 
-        # Send the notification
-        sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=f'📚 Order Confirmed - BookBazar (${total_amount:.2f})',
-            Message=message
-        )
-        logger.info(f"Order confirmation notification sent for user: {username}")
-        
-    except ClientError as e:
-        logger.error(f"Error sending order confirmation notification: {e}")
-
-def send_cart_update_notification(username, cart_items, action="updated"):
-    """Send notification when cart is updated with book details"""
-    try:
-        if not cart_items:
-            return
-            
-        message = f"""
+def render_cart_update_header(username, action, update_time):
+    return f"""
 🛒 CART {action.upper()} - BookBazar
 
 👤 User: {username}
-📅 Time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+📅 Time: {update_time}
 
 📚 CURRENT CART CONTENTS:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
+{NOTIFICATION_RULE}"""
 
-        total_items = 0
-        total_value = 0
-        
-        for item in cart_items:
-            quantity = item.get('quantity', 1)
-            price = item.get('price', 0)
-            item_total = quantity * price
-            total_items += quantity
-            total_value += item_total
-            
-            message += f"""
+def render_cart_update_line(item, quantity, price_cents):
+    return f"""
 📖 {item.get('title', 'Unknown Title')}
    ✍️  Author: {item.get('author', 'Unknown Author')}
-   💰 Price: ${price:.2f} each
+   💰 Price: ${price_cents / 100:.2f} each
    📦 Quantity: {quantity}
-   💵 Subtotal: ${item_total:.2f}
-   ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
+   💵 Subtotal: ${quantity * price_cents / 100:.2f}
+   {NOTIFICATION_RULE}"""
 
-        message += f"""
+def render_cart_update_footer(total_items, total_value):
+    return f"""
 
 🛒 CART SUMMARY:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{NOTIFICATION_RULE}
 📚 Total Items: {total_items}
 💵 Cart Value: ${total_value:.2f}
 """
 
-        # Send the notification
-        sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=f'🛒 Cart {action.title()} - {username} (${total_value:.2f})',
-            Message=message
-        )
-        logger.info(f"Cart {action} notification sent for user: {username}")
+def notification_attributes(event_type, payload):
+    """SNS message attributes carrying the event type and a compact JSON payload"""
+    if not NOTIFY_MESSAGE_ATTRIBUTES:
+        return None
+    return {
+        'event_type': {'DataType': 'String', 'StringValue': event_type},
+        'payload': {'DataType': 'String', 'StringValue': json.dumps(payload, separators=(',', ':'))}
+    }
+
+def order_notification_attributes(order):
+    """Structured variant of an order confirmation, built from the stored order"""
+    return notification_attributes('order_confirmed', {
+        'order_id': order['order_id'],
+        'username': order['username'],
+        'created_at': order['created_at'],
+        'total_cents': order['total_cents'],
+        'items': order['lines'],
+        'customer': {'name': order['customer']['name'], 'email': order['customer']['email']}
+    })
+
+def build_order_confirmation_notification(username, cart_items, customer_info, total_amount):
+    """Build the (subject, message) of an order confirmation notification"""
+    try:
+        order_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        parts = [render_order_confirmation_header(username, customer_info, order_time)]
+        total_books = 0
+        for item in cart_items:
+            quantity = item.get('quantity', 1)
+            price_cents = item.get('price_cents') or price_to_cents(item.get('price', 0))
+            total_books += quantity
+            parts.append(render_order_confirmation_line(item, quantity, price_cents))
+        parts.append(render_order_confirmation_footer(total_books, total_amount))
+        message = ''.join(parts)
+        return f'📚 Order Confirmed - BookBazar (${total_amount:.2f})', message
         
-    except ClientError as e:
-        logger.error(f"Error sending cart {action} notification: {e}")
+    except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+        logger.error(f"Error building order confirmation notification: {e}")
+        return None
+
+def build_cart_update_notification(username, cart_items, action="updated"):
+    """Build the (subject, message, message attributes) of a cart update notification"""
+    try:
+        if not cart_items:
+            return None
+
+        parts = [render_cart_update_header(username, action, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))]
+        items = []
+        total_items = 0
+        total_cents = 0
+        for item in cart_items:
+            quantity = item.get('quantity', 1)
+            price_cents = item.get('price_cents') or price_to_cents(item.get('price', 0))
+            total_items += quantity
+            total_cents += quantity * price_cents
+            parts.append(render_cart_update_line(item, quantity, price_cents))
+            if NOTIFY_MESSAGE_ATTRIBUTES:
+                items.append({'id': item.get('id'), 'quantity': quantity, 'price_cents': price_cents})
+        total_value = cents_to_amount(total_cents)
+        parts.append(render_cart_update_footer(total_items, total_value))
+        message = ''.join(parts)
+
+        attributes = notification_attributes('cart_updated', {
+            'username': username,
+            'action': action,
+            'item_count': total_items,
+            'subtotal_cents': total_cents,
+            'items': items
+        })
+        return f'🛒 Cart {action.title()} - {username} (${total_value:.2f})', message, attributes
+        
+    except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+        logger.error(f"Error building cart {action} notification: {e}")
+        return None
+
+def send_cart_update_notification(username, cart_items=None, action="updated"):
+    """Queue a cart update notification, coalescing rapid updates per user.
+
+    When cart_items is None the cart is read when the notification is built,
+    so a burst of updates costs a single cart read.
+    """
+    if cart_items is None:
+        build = lambda: build_cart_update_notification(username, get_user_cart(username), action)
+    elif cart_items:
+        snapshot = [dict(item) for item in cart_items]
+        build = lambda: build_cart_update_notification(username, snapshot, action)
+    else:
+        return
+    notifier.submit_debounced(('cart', username), build)
 
 def find_book_by_id(book_id):
     """Find a book by its ID"""
-    books = load_books()
-    for book in books:
-        if book['id'] == book_id:
-            return book
-    return None
+    return catalog.get(book_id)
+
+def catalog_page_from_request():
+    """Read listing pagination and sort parameters from the query string"""
+    per_page = request.args.get('per_page', BOOKS_PER_PAGE, type=int)
+    return catalog.page(
+        sort=request.args.get('sort', 'title'),
+        descending=request.args.get('order') == 'desc',
+        page=max(request.args.get('page', 1, type=int), 1),
+        per_page=min(max(per_page, 1), BOOKS_MAX_PER_PAGE),
+        cursor=request.args.get('cursor')
+    )
+
+def render_listing(template_name, **context):
+    """Render a listing template, streaming it when ?stream=1 is given"""
+    if request.args.get('stream') == '1':
+        return app.response_class(stream_template(template_name, **context))
+    return render_template(template_name, **context)
+
+def listing_etag(pagination):
+    """Strong ETag for a catalog listing page, tied to the books.json revision"""
+    return (f"{catalog.revision}-{pagination['sort']}-{pagination['order']}-"
+            f"{pagination['offset']}-{pagination['per_page']}")
+
+def set_catalog_validators(response, etag, cache_control):
+    """Attach ETag, Last-Modified and Cache-Control headers for a catalog page"""
+    response.set_etag(etag)
+    response.last_modified = catalog.last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def has_pending_flashes():
+    """True if the session holds flash messages.
+
+    Requests without a session cookie cannot have any, and skip the session:
+    reading it adds Vary: Cookie, which keeps shared caches from storing the page.
+    """
+    return app.config['SESSION_COOKIE_NAME'] in request.cookies and '_flashes' in session
+
+def catalog_not_modified(etag, cache_control):
+    """Return a 304 response when the client's copy of a catalog page is current.
+
+    Pages with pending flash messages are always rendered, since the
+    cached copy would not show them.
+    """
+    if has_pending_flashes():
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = request.if_modified_since is not None and request.if_modified_since >= catalog.last_modified
+    if not fresh:
+        return None
+    return set_catalog_validators(app.response_class(status=304), etag, cache_control)
+
+def render_catalog_listing(template_name, etag, cache_control, **context):
+    """Render a catalog listing with validators, or no-store if flash messages are shown"""
+    has_flashes = has_pending_flashes()
+    response = app.make_response(render_listing(template_name, **context))
+    if has_flashes:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    return set_catalog_validators(response, etag, cache_control)
+
+def catalog_json_response(body, etag):
+    """Publicly cacheable JSON response for catalog data, answered with 304 when the ETag matches"""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={BROWSE_MAX_AGE}'
+    return response.make_conditional(request)
+
+def overload_response(status, retry_after, message):
+    """Fast 429/503 with Retry-After: JSON for API routes, plain text for pages"""
+    headers = {'Retry-After': str(max(1, math.ceil(retry_after)))}
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': message}), status, headers
+    return app.response_class(message, status=status, headers=headers, mimetype='text/plain')
+
+def rate_limited(category):
+    """Shed requests over the caller's or the process-wide token bucket rate with a 429"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            retry_after = admit(category, session.get('username') or request.remote_addr)
+            if retry_after:
+                return overload_response(429, retry_after, 'Too many requests. Please slow down and try again.')
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.errorhandler(DependencyOverloaded)
+def dependency_overloaded(error):
+    logger.warning(f"Shedding {request.method} {request.path}: {error}")
+    return overload_response(503, error.retry_after, 'The service is busy right now. Please try again shortly.')
+
+def cache_public(max_age):
+    """Mark a page as cacheable by browsers and shared caches for max_age seconds"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            has_flashes = has_pending_flashes()
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or has_flashes:
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+            response.headers['Cache-Control'] = f'public, max-age={max_age}'
+            response.add_etag()
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+# Request and template timing
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe((route, request.method, str(response.status_code)), time.perf_counter() - started)
+    return response
+
+@app.after_request
+def cache_hashed_assets(response):
+    """Build files are content-hashed, so browsers and CDNs can keep them for a year"""
+    if (request.endpoint == 'static' and response.status_code in (200, 304)
+            and request.view_args.get('filename', '').startswith(HASHED_ASSET_PREFIX)):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = HASHED_ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.expires = int(time.time() + HASHED_ASSET_MAX_AGE)
+    return response
+
+_template_timers = threading.local()
+
+def start_template_timer(sender, template, context, **extra):
+    _template_timers.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+def record_template_latency(sender, template, context, **extra):
+    stack = getattr(_template_timers, 'stack', None)
+    if stack:
+        DEPENDENCY_LATENCY.observe(('template', template.name), time.perf_counter() - stack.pop())
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template_latency, app)
 
 # Home route - show index.html landing page
 @app.route('/')
@@ -311,7 +3661,12 @@ def register():
             return render_template('register.html')
 
         # Register user
-        if create_user_in_db(username, password):
+        try:
+            created = create_user_in_db(username, password)
+        except PasswordHasherBusy:
+            flash('We are busy right now. Please try again in a moment.', 'error')
+            return render_template('register.html'), 503, {'Retry-After': '1'}
+        if created:
             flash('Registration successful! Please login.', 'success')
             
             # Send notification about new user registration
@@ -348,8 +3703,12 @@ def login():
             flash('Username and password are required!', 'error')
             return render_template('login.html')
 
-        user = get_user_from_db(username)
-        if user and user.get('password') == password:
+        try:
+            authenticated = authenticate_user(username, password)
+        except PasswordHasherBusy:
+            flash('Too many sign-in attempts right now. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
+        if authenticated:
             session['username'] = username
             flash(f'Welcome back, {username}!', 'success')
             
@@ -372,14 +3731,25 @@ def books():
         flash('Please login to access the library.', 'error')
         return redirect(url_for('login'))
 
-    books_data = load_books()
+    pagination = catalog_page_from_request()
+    etag = listing_etag(pagination)
+    cache_control = 'private, no-cache'
+    not_modified = catalog_not_modified(etag, cache_control)
+    if not_modified:
+        return not_modified
+
     username = session['username']
-    cart_items = get_user_cart(username)
-    cart_count = sum(item['quantity'] for item in cart_items)
-    return render_template('books.html', books=books_data, cart_count=cart_count)
+    cart_count = session_cart_summary(username)['count']
+    book_grid = fragment_cache.get_or_render(
+        ('books', etag),
+        lambda: render_template('_book_grid.html', books=pagination['books'])
+    )
+    return render_catalog_listing('books.html', etag, cache_control, books=pagination['books'],
+                                  book_grid=book_grid, pagination=pagination, cart_count=cart_count)
 
 # Add to cart route
 @app.route('/add_to_cart/<int:book_id>')
+@rate_limited('mutation')
 def add_to_cart(book_id):
     if 'username' not in session:
         flash('Please login to add items to cart.', 'error')
@@ -392,29 +3762,18 @@ def add_to_cart(book_id):
         flash('Book not found!', 'error')
         return redirect(url_for('books'))
 
-    cart = get_user_cart(username)
-    
-    # Check if book already in cart
-    for item in cart:
-        if item['id'] == book_id:
-            item['quantity'] += 1
-            update_user_cart(username, cart)
-            flash(f'Increased quantity of "{book["title"]}" in cart!', 'success')
-            
-            # Send cart update notification
-            send_cart_update_notification(username, cart, "updated")
-            return redirect(url_for('books'))
-    
-    # Add new item to cart
-    cart_item = book.copy()
-    cart_item['quantity'] = 1
-    cart.append(cart_item)
-    update_user_cart(username, cart)
-    
-    flash(f'"{book["title"]}" added to cart!', 'success')
+    quantity = change_cart_quantity(username, book_id, 1)
+    if quantity is None:
+        flash('Could not update your cart. Please try again.', 'error')
+        return redirect(url_for('books'))
+
+    if quantity > 1:
+        flash(f'Increased quantity of "{book["title"]}" in cart!', 'success')
+    else:
+        flash(f'"{book["title"]}" added to cart!', 'success')
     
     # Send cart update notification
-    send_cart_update_notification(username, cart, "updated")
+    send_cart_update_notification(username, action="updated")
     return redirect(url_for('books'))
 
 # Cart page
@@ -428,38 +3787,37 @@ def cart():
     cart_items = get_user_cart(username)
     
     # Calculate total
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
+    total = cents_to_amount(cart_total_cents(cart_items))
     
     return render_template('cart.html', cart_items=cart_items, total=total)
 
 # Update cart quantity
 @app.route('/update_cart/<int:book_id>/<action>')
+@rate_limited('mutation')
 def update_cart(book_id, action):
     if 'username' not in session:
         return redirect(url_for('login'))
 
     username = session['username']
-    cart = get_user_cart(username)
-    
-    for i, item in enumerate(cart):
-        if item['id'] == book_id:
-            if action == 'increase':
-                item['quantity'] += 1
-            elif action == 'decrease':
-                if item['quantity'] > 1:
-                    item['quantity'] -= 1
-                else:
-                    cart.pop(i)
-                    flash(f'"{item["title"]}" removed from cart!', 'info')
-            elif action == 'remove':
-                cart.pop(i)
-                flash(f'"{item["title"]}" removed from cart!', 'info')
-            break
-    
-    update_user_cart(username, cart)
+    book = find_book_by_id(book_id)
+    title = book['title'] if book else 'Book'
+
+    if action == 'increase':
+        if not book:
+            flash('Book not found!', 'error')
+            return redirect(url_for('cart'))
+        change_cart_quantity(username, book_id, 1)
+    elif action == 'decrease':
+        # A decrease returns 0 both when it removed the line and when there was none, so check first
+        if book_id in get_user_cart_lines(username) and change_cart_quantity(username, book_id, -1) == 0:
+            flash(f'"{title}" removed from cart!', 'info')
+    elif action == 'remove':
+        # remove_cart_item returns 0 when the book was not in the cart
+        if remove_cart_item(username, book_id):
+            flash(f'"{title}" removed from cart!', 'info')
     
     # Send cart update notification
-    send_cart_update_notification(username, cart, "updated")
+    send_cart_update_notification(username, action="updated")
     return redirect(url_for('cart'))
 
 # Checkout page
@@ -476,19 +3834,43 @@ def checkout():
         flash('Your cart is empty!', 'error')
         return redirect(url_for('cart'))
     
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    return render_template('checkout.html', cart_items=cart_items, total=total)
+    total = cents_to_amount(cart_total_cents(cart_items))
+    # One idempotency key per checkout, so a resubmitted form cannot place a second order
+    idempotency_key = session.setdefault('checkout_key', uuid.uuid4().hex)
+    return render_template('checkout.html', cart_items=cart_items, total=total, idempotency_key=idempotency_key)
+
+def render_order_confirmation(order):
+    """Render the confirmation page for a placed order"""
+    return render_template('confirmation.html',
+                         order_id=order['order_id'],
+                         order_total=cents_to_amount(order['total_cents']),
+                         customer_name=order['customer']['name'],
+                         customer_email=order['customer']['email'])
 
 # Process checkout
 @app.route('/process_checkout', methods=['POST'])
+@rate_limited('mutation')
 def process_checkout():
     if 'username' not in session:
         return redirect(url_for('login'))
 
     username = session['username']
-    cart_items = get_user_cart(username)
+    order_id = (request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+                or session.get('checkout_key') or uuid.uuid4().hex)
+    if not IDEMPOTENCY_KEY_RE.fullmatch(order_id):
+        flash('Invalid checkout request. Please try again.', 'error')
+        return redirect(url_for('checkout'))
+
+    # Read from storage, not the cart cache: the order is conditional on the cart version read here
+    cart = get_user_cart_for_update(username)
+    lines, cart_version = cart if cart is not None else ({}, 0)
+    cart_items = hydrate_cart(lines)
     
     if not cart_items:
+        # A resubmitted checkout finds the cart already cleared by its order
+        order = get_order(order_id)
+        if order is not None and order['username'] == username:
+            return render_order_confirmation(order)
         flash('Your cart is empty!', 'error')
         return redirect(url_for('cart'))
 
@@ -503,9 +3885,6 @@ def process_checkout():
         flash('All fields are required!', 'error')
         return redirect(url_for('checkout'))
 
-    # Process order (in real app, integrate with payment gateway)
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
-    
     # Prepare customer info
     customer_info = {
         'name': name,
@@ -514,17 +3893,28 @@ def process_checkout():
         'payment_method': payment_method
     }
     
-    # Send detailed order confirmation notification
-    send_order_confirmation_notification(username, cart_items, customer_info, total)
-    
-    # Clear cart after successful order
-    update_user_cart(username, [])
-    
-    # Redirect to confirmation with order details
-    return render_template('confirmation.html', 
-                         order_total=total, 
-                         customer_name=name,
-                         customer_email=email)
+    # Record the order and clear the cart in one write (in real app, integrate with payment gateway);
+    # the confirmation is sent by the outbox worker
+    order = new_order(order_id, username, cart_items, customer_info)
+    status = create_order(order, cart_version)
+    if status == 'duplicate':
+        order = get_order(order_id)
+        if order is None or order['username'] != username:
+            flash('Invalid checkout request. Please try again.', 'error')
+            return redirect(url_for('checkout'))
+    elif status == 'cart_changed':
+        flash('Your cart changed during checkout. Please review it and try again.', 'error')
+        return redirect(url_for('cart'))
+    elif status is None:
+        flash('We could not place your order. Please try again.', 'error')
+        return redirect(url_for('checkout'))
+    else:
+        order_outbox.schedule(order_id)
+        logger.info(f"Order {order_id} placed by {username}")
+
+    if session.get('checkout_key') == order_id:
+        session.pop('checkout_key')
+    return render_order_confirmation(order)
 
 # Library route (alternative view) - requires login
 @app.route('/library')
@@ -533,22 +3923,164 @@ def library():
         flash('Please login to access the library.', 'error')
         return redirect(url_for('login'))
 
-    books_data = load_books()
+    pagination = catalog_page_from_request()
     username = session['username']
-    cart_items = get_user_cart(username)
-    cart_count = sum(item['quantity'] for item in cart_items)
-    return render_template('library.html', books=books_data, cart_count=cart_count)
+    cart_count = session_cart_summary(username)['count']
+    return render_listing('library.html', books=pagination['books'], pagination=pagination, cart_count=cart_count)
 
 # API endpoint to get cart count
 @app.route('/api/cart_count')
+@rate_limited('poll')
 def cart_count():
     if 'username' not in session:
-        return jsonify({'count': 0})
+        return jsonify({'count': 0, 'subtotal': 0})
     
+    summary = session_cart_summary(session['username'])
+    return jsonify({'count': summary['count'], 'subtotal': cents_to_amount(summary['subtotal_cents'])})
+
+# API endpoint for a single book (used by the book details modal)
+@app.route('/api/book/<int:book_id>')
+def api_book(book_id):
+    body = catalog.get_json(book_id)
+    if body is None:
+        return jsonify({'error': 'Book not found'}), 404
+    return catalog_json_response(body, f"{catalog.revision}-book-{book_id}")
+
+# API endpoint for the books related to a book, from the table built at catalog load
+@app.route('/api/book/<int:book_id>/related')
+def api_book_related(book_id):
+    if catalog.get_json(book_id) is None:
+        return jsonify({'error': 'Book not found'}), 404
+    related = catalog.related_ids(book_id)
+    if related is None:
+        return overload_response(503, 5, 'Related books are still being computed. Please try again shortly.')
+    found, _ = catalog.get_json_many(related)
+    body = b''.join((f'{{"book_id":{book_id},"related":['.encode(), b','.join(found), b']}'))
+    return catalog_json_response(body, f"{catalog.revision}-related-{book_id}")
+
+# API endpoint to fetch several books at once: /api/books?ids=1,2,3
+@app.route('/api/books')
+def api_books():
+    try:
+        ids = list(dict.fromkeys(int(part) for part in request.args.get('ids', '').split(',') if part.strip()))
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of book ids'}), 400
+    if not ids:
+        return jsonify({'error': 'No book ids given'}), 400
+    if len(ids) > API_BOOKS_MAX_IDS:
+        return jsonify({'error': f'At most {API_BOOKS_MAX_IDS} ids per request'}), 400
+
+    found, missing = catalog.get_json_many(ids)
+    body = b''.join((b'{"books":[', b','.join(found), b'],"missing":', json.dumps(missing).encode(), b'}'))
+    ids_digest = hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest()[:16]
+    return catalog_json_response(body, f"{catalog.revision}-books-{ids_digest}")
+
+# API endpoint to add a book to the cart without a page reload
+@app.route('/api/add-to-cart', methods=['POST'])
+@rate_limited('mutation')
+def api_add_to_cart():
+    if 'username' not in session:
+        return jsonify({'success': False, 'error': 'Please login to add items to cart.'}), 401
+
+    # Only JSON bodies are accepted, so plain cross-site form posts cannot add to the cart
+    data = request.get_json(silent=True)
+    book_id = data.get('book_id') if isinstance(data, dict) else None
+    if isinstance(book_id, bool) or not isinstance(book_id, int):
+        return jsonify({'success': False, 'error': 'A numeric book_id is required'}), 400
+
+    book = find_book_by_id(book_id)
+    if not book:
+        return jsonify({'success': False, 'error': 'Book not found'}), 404
+
     username = session['username']
-    cart_items = get_user_cart(username)
-    count = sum(item['quantity'] for item in cart_items)
-    return jsonify({'count': count})
+    quantity = change_cart_quantity(username, book_id, 1)
+    if quantity is None:
+        return jsonify({'success': False, 'error': 'Could not update your cart. Please try again.'}), 503
+
+    send_cart_update_notification(username, action="updated")
+    summary = session_cart_summary(username)
+    return jsonify({
+        'success': True,
+        'message': f'"{book["title"]}" added to cart!',
+        'book_id': book_id,
+        'quantity': quantity,
+        'count': summary['count'],
+        'subtotal': cents_to_amount(summary['subtotal_cents'])
+    })
+
+# API endpoint to apply several cart edits in one storage write (e.g. merging a cart kept in the browser)
+@app.route('/api/cart/batch', methods=['POST'])
+@rate_limited('mutation')
+def api_cart_batch():
+    if 'username' not in session:
+        return jsonify({'success': False, 'error': 'Please login to update your cart.'}), 401
+
+    data = request.get_json(silent=True)
+    try:
+        operations = parse_cart_operations(data.get('operations') if isinstance(data, dict) else None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    username = session['username']
+    lines = apply_cart_batch(username, operations)
+    if lines is None:
+        return jsonify({'success': False, 'error': 'Could not update your cart. Please try again.'}), 503
+
+    send_cart_update_notification(username, action="updated")
+    summary = cart_summary(lines)
+    return jsonify({
+        'success': True,
+        'cart': {str(book_id): quantity for book_id, quantity in lines.items()},
+        'count': summary['count'],
+        'subtotal': cents_to_amount(summary['subtotal_cents'])
+    })
+
+def finite_float(value):
+    """float() that rejects inf and nan, for request.args.get(type=...)"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value!r}")
+    return number
+
+# API endpoint for catalog search with facets
+@app.route('/api/search')
+def api_search():
+    # Malformed or non-finite numeric parameters are ignored (request.args.get returns None)
+    filters = {
+        'genre': request.args.get('genre') or None,
+        'year_min': request.args.get('year_min', type=int),
+        'year_max': request.args.get('year_max', type=int),
+        'price_min': request.args.get('price_min', type=finite_float),
+        'price_max': request.args.get('price_max', type=finite_float),
+        'limit': min(max(request.args.get('limit', 20, type=int), 1), SEARCH_MAX_LIMIT),
+        'offset': max(request.args.get('offset', 0, type=int), 0)
+    }
+
+    query = request.args.get('q', '')
+    result = catalog.search(query, **filters)
+    results = []
+    for book_id, score in result['results']:
+        book = catalog.get(book_id)
+        if book is None:
+            continue  # Catalog reloaded since the search ran
+        results.append({
+            'id': book_id,
+            'title': book.get('title'),
+            'author': book.get('author'),
+            'genre': book.get('genre'),
+            'year': book.get('year'),
+            'price': book.get('price'),
+            'image': book.get('image'),
+            'score': round(score, 4)
+        })
+    return jsonify({
+        'query': query,
+        'total': result['total'],
+        'offset': filters['offset'],
+        'limit': filters['limit'],
+        'results': results,
+        'facets': result['facets']
+    })
 
 # User profile/account page
 @app.route('/account')
@@ -558,41 +4090,110 @@ def account():
         return redirect(url_for('login'))
     
     username = session['username']
-    cart_items = get_user_cart(username)
-    cart_count = sum(item['quantity'] for item in cart_items)
+    cart_count = session_cart_summary(username)['count']
     return render_template('account.html', username=username, cart_count=cart_count)
 
 # Browse books (public route - doesn't require login, shows limited info)
 @app.route('/browse')
 def browse():
-    books_data = load_books()
-    return render_template('browse.html', books=books_data)
+    pagination = catalog_page_from_request()
+    etag = listing_etag(pagination)
+    cache_control = f'public, max-age={BROWSE_MAX_AGE}'
+    not_modified = catalog_not_modified(etag, cache_control)
+    if not_modified:
+        return not_modified
+    return render_catalog_listing('browse.html', etag, cache_control, books=pagination['books'],
+                                  pagination=pagination)
 
 # About page
 @app.route('/about')
+@cache_public(PUBLIC_PAGE_MAX_AGE)
 def about():
     return render_template('about.html')
 
 # Contact page  
 @app.route('/contact')
+@cache_public(PUBLIC_PAGE_MAX_AGE)
 def contact():
     return render_template('contact.html')
 
 # FAQ page
 @app.route('/faq')
+@cache_public(PUBLIC_PAGE_MAX_AGE)
 def faq():
     return render_template('faq.html')
 
 # Terms page
 @app.route('/terms')
+@cache_public(PUBLIC_PAGE_MAX_AGE)
 def terms():
     return render_template('terms.html')
 
 # Privacy policy page
 @app.route('/privacy')
+@cache_public(PUBLIC_PAGE_MAX_AGE)
 def privacy():
     return render_template('privacy.html')
 
+# Prometheus metrics endpoint
+@app.route('/metrics')
+def metrics():
+    lines = REQUEST_LATENCY.render() + DEPENDENCY_LATENCY.render()
+
+    def gauge(name, help_text, value, metric_type='gauge'):
+        lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}'])
+
+    cart_stats = cart_cache.stats()
+    gauge('bookbazar_cart_cache_hits_total', 'Cart cache hits.', cart_stats['hits'], 'counter')
+    gauge('bookbazar_cart_cache_misses_total', 'Cart cache misses.', cart_stats['misses'], 'counter')
+    gauge('bookbazar_cart_cache_entries', 'Carts held in the cart cache.', cart_stats['size'])
+    fragment_stats = fragment_cache.stats()
+    gauge('bookbazar_fragment_cache_hits_total', 'Fragment cache hits.', fragment_stats['hits'], 'counter')
+    gauge('bookbazar_fragment_cache_misses_total', 'Fragment cache misses.', fragment_stats['misses'], 'counter')
+    notifier_stats = notifier.stats()
+    for key in ('submitted', 'sent', 'failed', 'dropped', 'coalesced'):
+        gauge(f'bookbazar_notifications_{key}_total', f'Notifications {key}.', notifier_stats[key], 'counter')
+    gauge('bookbazar_notifications_queued', 'Notifications waiting for a worker.', notifier_stats['queued'])
+    outbox_stats = order_outbox.stats()
+    for key in ('scheduled', 'sent', 'retried', 'failed'):
+        gauge(f'bookbazar_order_outbox_{key}_total', f'Order confirmations {key}.', outbox_stats[key], 'counter')
+    gauge('bookbazar_order_outbox_pending', 'Order confirmations waiting to be sent.', outbox_stats['pending'])
+    gauge('bookbazar_io_calls_total', 'Calls offloaded to the I/O pool by async handlers.',
+          io_counters['calls'], 'counter')
+    gauge('bookbazar_io_rejected_total', 'I/O pool calls shed with too many pending.',
+          io_counters['rejected'], 'counter')
+    gauge('bookbazar_io_pending', 'I/O pool calls queued or running.', io_counters['pending'])
+    session_store = getattr(app.session_interface, 'store', None)
+    if session_store is not None:
+        session_stats = session_store.stats()
+        gauge('bookbazar_session_cache_hits_total', 'Session store cache hits.', session_stats['hits'], 'counter')
+        gauge('bookbazar_session_cache_misses_total', 'Session store cache misses.', session_stats['misses'], 'counter')
+        gauge('bookbazar_session_cache_entries', 'Sessions held in this process.', session_stats['size'])
+    password_stats = password_hasher.stats()
+    gauge('bookbazar_password_hashes_total', 'Password hashes computed.', password_stats['hashed'], 'counter')
+    gauge('bookbazar_password_hashes_rejected_total', 'Password hashes rejected while the pool was full.',
+          password_stats['rejected'], 'counter')
+    for category, limiter in [*rate_limiters.items(), ('global', global_rate_limiter)]:
+        limiter_stats = limiter.stats()
+        gauge(f'bookbazar_rate_limit_{category}_allowed_total', f'Requests admitted by the {category} rate limit.',
+              limiter_stats['allowed'], 'counter')
+        gauge(f'bookbazar_rate_limit_{category}_limited_total', f'Requests rejected by the {category} rate limit.',
+              limiter_stats['limited'], 'counter')
+    for name, limiter in dependency_limiters.items():
+        limiter_stats = limiter.stats()
+        gauge(f'bookbazar_dependency_{name}_calls_total', f'{name} calls started.', limiter_stats['calls'], 'counter')
+        gauge(f'bookbazar_dependency_{name}_rejected_total', f'{name} calls shed with too many already queued.',
+              limiter_stats['rejected'], 'counter')
+        gauge(f'bookbazar_dependency_{name}_timed_out_total', f'{name} calls shed after waiting for a slot.',
+              limiter_stats['timed_out'], 'counter')
+        gauge(f'bookbazar_dependency_{name}_in_flight', f'{name} calls in flight.', limiter_stats['in_flight'])
+        gauge(f'bookbazar_dependency_{name}_waiting', f'{name} calls waiting for a slot.', limiter_stats['waiting'])
+    gauge('bookbazar_catalog_books', 'Books in the catalog.', len(catalog.books))
+    gauge('bookbazar_catalog_version', 'Catalog reloads in this process.', catalog.version)
+    gauge('bookbazar_startup_seconds', 'Module initialization time.', f'{STARTUP_SECONDS:.6f}')
+
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 # Logout
 @app.route('/logout')
 def logout():
@@ -601,6 +4202,93 @@ def logout():
     flash(f'Goodbye, {username}! You have been logged out.', 'info')
     return redirect(url_for('home'))
 
+# Offline migration of legacy carts (carts are otherwise migrated lazily on first read)
+@app.cli.command('migrate-carts')
+def migrate_carts_command():
+    """Convert every cart stored as a list of book copies to per-book quantities"""
+    if not hasattr(storage, 'migrate_legacy_carts'):
+        print(f"Storage backend '{STORAGE_BACKEND}' has no legacy carts to migrate")
+        return
+    started = time.perf_counter()
+    try:
+        migrated, failed = storage.migrate_legacy_carts()
+    except ClientError as e:
+        logger.error(f"Error scanning carts table: {e}")
+        raise SystemExit(1)
+    print(f"Migrated {migrated} carts ({failed} failed) in {time.perf_counter() - started:.1f}s")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('revoke-sessions')
+@click.argument('username')
+def revoke_sessions_command(username):
+    """Log a user out of every session (SQLite session store; memory sessions live in the server process)"""
+    if SESSION_STORE != 'sqlite':
+        print(f"Session store '{SESSION_STORE}' cannot be revoked from the command line")
+        raise SystemExit(1)
+    revoke_user_sessions(username)
+    print(f"Revoked all sessions of {username}")
+
+# Bulk import of users and carts through the storage batch APIs
+@app.cli.command('import-accounts')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--overwrite', is_flag=True, help='Replace existing users instead of skipping them.')
+@click.option('--chunk-size', default=500, show_default=True, help='Accounts read and written per round.')
+def import_accounts_command(path, overwrite, chunk_size):
+    """Bulk-load users and carts from a JSONL file with one account per line"""
+    started = time.perf_counter()
+    totals = Counter()
+
+    def report(label):
+        elapsed = time.perf_counter() - started
+        written = totals['users_written'] + totals['carts_written']
+        print(f"{label}: {totals['users_written']} users ({totals['users_skipped']} skipped, "
+              f"{totals['users_failed']} failed), {totals['carts_written']} carts ({totals['carts_failed']} failed), "
+              f"{totals['invalid']} invalid rows, {totals['retried']} unprocessed items retried; "
+              f"{elapsed:.1f}s, {written / elapsed if elapsed else 0:.0f} items/s")
+
+    chunk = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                chunk.append(json.loads(line))
+            except ValueError:
+                logger.error(f"Skipping line {line_number}: not valid JSON")
+                totals['invalid'] += 1
+                continue
+            if len(chunk) >= chunk_size:
+                totals.update(import_accounts(chunk, overwrite))
+                chunk = []
+                report('Progress')
+    if chunk:
+        totals.update(import_accounts(chunk, overwrite))
+    report('Imported')
+    if totals['users_failed'] or totals['carts_failed']:
+        raise SystemExit(1)
+
+# Offline build of the related-books table, so workers load it instead of each rebuilding it
+@app.cli.command('build-related')
+def build_related_command():
+    """Compute the related books of every catalog book and store them next to the catalog"""
+    books_digest = file_digest(catalog.books_path)
+    if books_digest is None:
+        print(f"Catalog file {catalog.books_path} not found")
+        raise SystemExit(1)
+    started = time.perf_counter()
+    related = build_related_books(load_books(catalog.books_path))
+    temporary_path = f"{catalog.related_path}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump({'books_digest': books_digest, 'k': RELATED_BOOKS_K, 'related': related}, f, separators=(',', ':'))
+    # Running workers reload the catalog when this file changes
+    os.replace(temporary_path, catalog.related_path)
+    print(f"Built related books for {len(related)} books in {time.perf_counter() - started:.1f}s "
+          f"into {catalog.related_path}")
+
+STARTUP_SECONDS = time.perf_counter() - _startup_started
+logger.info(f"BookBazar initialized in {STARTUP_SECONDS * 1000:.1f} ms")
+
 if __name__ == '__main__':
     # Create data directory if it doesn't exist
     os.makedirs('data', exist_ok=True)
@@ -0,0 +1,127 @@
+"""ASGI entry point for BookBazar.
+
+Connections are handled on the uvicorn event loop, so idle keep-alive
+sessions and the /api/cart_count polling from open tabs do not each hold
+a thread. Flask routes run on a bounded WSGI thread pool (a2wsgi), and
+the cart count poll is answered natively with its storage read offloaded
+to the app's I/O pool.
+
+Run with:
+
+    python asgi.py
+    # or
+    uvicorn asgi:application --workers 4 --limit-concurrency 4000
+"""
+import json
+import math
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.wrappers import Request
+
+import app as bookbazar
+
+# Serving configuration
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '5000'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))  # worker processes
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '64'))  # threads running Flask routes, per process
+ASGI_LIMIT_CONCURRENCY = int(os.environ.get('ASGI_LIMIT_CONCURRENCY', '4000'))  # connections before 503
+ASGI_BACKLOG = int(os.environ.get('ASGI_BACKLOG', '2048'))
+ASGI_KEEPALIVE_TIMEOUT = int(os.environ.get('ASGI_KEEPALIVE_TIMEOUT', '15'))
+
+wsgi_application = WSGIMiddleware(bookbazar.app, workers=WSGI_THREADS)
+
+
+def open_session(scope):
+    """Open the Flask session referenced by the request's session cookie"""
+    headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'PATH_INFO': scope['path'],
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': str(PORT),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'HTTP_COOKIE': headers.get('cookie', ''),
+    }
+    flask_session = bookbazar.app.session_interface.open_session(bookbazar.app, Request(environ))
+    return flask_session if flask_session is not None else {}
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def cart_count(scope, receive, send):
+    """Async /api/cart_count: the session load and storage read run on the I/O pool, not a request thread"""
+    started = time.perf_counter()
+    try:
+        # Server-side session stores query their backend, so the load stays off the event loop
+        flask_session = await bookbazar.run_io(open_session, scope)
+        username = flask_session.get('username')
+        client_address = (scope.get('client') or ('', 0))[0]
+        retry_after = bookbazar.admit('poll', username or client_address)
+        if retry_after:
+            await send_json(send, 429, {'success': False,
+                                        'error': 'Too many requests. Please slow down and try again.'},
+                            [(b'retry-after', str(max(1, math.ceil(retry_after))).encode())])
+            bookbazar.REQUEST_LATENCY.observe(('/api/cart_count', 'GET', '429'), time.perf_counter() - started)
+            return
+        # Server-side sessions may already hold a fresh cart summary
+        summary = bookbazar.fresh_session_cart_summary(flask_session) if username else bookbazar.EMPTY_CART_SUMMARY
+        if summary is None:
+            summary = await bookbazar.run_io(bookbazar.get_cart_summary, username)
+    except bookbazar.DependencyOverloaded as error:
+        bookbazar.logger.warning(f"Shedding GET /api/cart_count: {error}")
+        await send_json(send, 503, {'success': False,
+                                    'error': 'The service is busy right now. Please try again shortly.'},
+                        [(b'retry-after', str(max(1, math.ceil(error.retry_after))).encode())])
+        bookbazar.REQUEST_LATENCY.observe(('/api/cart_count', 'GET', '503'), time.perf_counter() - started)
+        return
+    await send_json(send, 200, {
+        'count': summary['count'],
+        'subtotal': bookbazar.cents_to_amount(summary['subtotal_cents']),
+    })
+    bookbazar.REQUEST_LATENCY.observe(('/api/cart_count', 'GET', '200'), time.perf_counter() - started)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            bookbazar.order_outbox.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            bookbazar.notifier.shutdown()
+            bookbazar.order_outbox.shutdown()
+            bookbazar.io_executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/cart_count':
+        return await cart_count(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(
+        'asgi:application',
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        limit_concurrency=ASGI_LIMIT_CONCURRENCY,
+        backlog=ASGI_BACKLOG,
+        timeout_keep_alive=ASGI_KEEPALIVE_TIMEOUT,
+    )
@@ -0,0 +1,299 @@
+"""In-process stand-ins for the DynamoDB tables and SNS client used by app.py.
+
+They implement only the calls and expression forms the app issues, keep
+data in memory, and can add a fixed latency to every call to mimic the
+network round trip to AWS.
+"""
+import copy
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+def _split_clauses(body):
+    """Split an update action body on the commas outside parentheses"""
+    clauses, depth, current = [], 0, ''
+    for char in body:
+        if char == ',' and depth == 0:
+            clauses.append(current.strip())
+            current = ''
+            continue
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        current += char
+    if current.strip():
+        clauses.append(current.strip())
+    return clauses
+
+
+def _client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeTable:
+    """Dict-backed DynamoDB Table resource with optional per-call latency"""
+
+    def __init__(self, key_name='username', latency=0.0, name=None):
+        self.key_name = key_name
+        self.name = name
+        self.latency = latency
+        self.items = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _name(token, names):
+        return names.get(token, token)
+
+    def _check(self, item, condition, names, values):
+        if not condition:
+            return True
+        if ' OR ' in condition:
+            return any(self._check(item, part, names, values) for part in condition.split(' OR '))
+        if ' AND ' in condition:
+            return all(self._check(item, part, names, values) for part in condition.split(' AND '))
+        match = re.fullmatch(r'attribute_exists\((\S+)\)', condition)
+        if match:
+            return item is not None and self._name(match.group(1), names) in item
+        match = re.fullmatch(r'attribute_not_exists\((\S+)\)', condition)
+        if match:
+            return item is None or self._name(match.group(1), names) not in item
+        match = re.fullmatch(r'(\S+) ([<>=]) (\S+)', condition)
+        if match:
+            name = self._name(match.group(1), names)
+            if item is None or name not in item:
+                return False
+            value = values[match.group(3)]
+            return {'<': item[name] < value, '>': item[name] > value, '=': item[name] == value}[match.group(2)]
+        raise NotImplementedError(f"Condition not supported by FakeTable: {condition}")
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._wait()
+        with self._lock:
+            item = self.items.get(Key[self.key_name])
+            if item is None:
+                return {}
+            item = copy.deepcopy(item)
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            wanted = {self._name(token.strip(), names) for token in ProjectionExpression.split(',')}
+            item = {name: value for name, value in item.items() if name in wanted}
+        return {'Item': item}
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, **kwargs):
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self.items.values()
+                     if self._check(item, FilterExpression, names, ExpressionAttributeValues or {})]
+        if ProjectionExpression:
+            wanted = {self._name(token.strip(), names) for token in ProjectionExpression.split(',')}
+            items = [{name: value for name, value in item.items() if name in wanted} for item in items]
+        return {'Items': items, 'Count': len(items)}
+
+    def query(self, KeyConditionExpression, IndexName=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        """Query by key condition; an index is treated as sparse, holding only items that have its keys"""
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self.items.values()
+                     if self._check(item, KeyConditionExpression, names, ExpressionAttributeValues or {})]
+        if ProjectionExpression:
+            wanted = {self._name(token.strip(), names) for token in ProjectionExpression.split(',')}
+            items = [{name: value for name, value in item.items() if name in wanted} for item in items]
+        return {'Items': items, 'Count': len(items)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self._wait()
+        with self._lock:
+            current = self.items.get(Item[self.key_name])
+            if not self._check(current, ConditionExpression, ExpressionAttributeNames or {},
+                               ExpressionAttributeValues or {}):
+                raise _client_error('ConditionalCheckFailedException', 'PutItem')
+            self.items[Item[self.key_name]] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._wait()
+        with self._lock:
+            self.items.pop(Key[self.key_name], None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            current = self.items.get(Key[self.key_name])
+            if not self._check(current, ConditionExpression, names, values):
+                raise _client_error('ConditionalCheckFailedException', 'UpdateItem')
+            before = copy.deepcopy(current) if current else dict(Key)
+            item = copy.deepcopy(before)
+            touched = []
+            for action, body in re.findall(r'(SET|ADD|REMOVE) (.*?)(?= SET | ADD | REMOVE |$)', UpdateExpression):
+                for clause in _split_clauses(body):
+                    if action == 'ADD':
+                        name, value = clause.split()
+                        name = self._name(name, names)
+                        item[name] = item.get(name, 0) + values[value]
+                    elif action == 'REMOVE':
+                        name = self._name(clause, names)
+                        item.pop(name, None)
+                    else:
+                        name, expression = (part.strip() for part in clause.split('=', 1))
+                        name = self._name(name, names)
+                        item[name] = self._evaluate(item, expression, names, values)
+                    touched.append(name)
+            self.items[Key[self.key_name]] = item
+
+        source = item if ReturnValues == 'UPDATED_NEW' else before
+        return {'Attributes': {name: source[name] for name in touched if name in source}}
+
+    def _evaluate(self, item, expression, names, values):
+        match = re.fullmatch(r'if_not_exists\((\S+), (\S+)\) \+ (\S+)', expression)
+        if match:
+            return item.get(self._name(match.group(1), names), values[match.group(2)]) + values[match.group(3)]
+        match = re.fullmatch(r'(\S+) ([+-]) (\S+)', expression)
+        if match:
+            left = item.get(self._name(match.group(1), names), 0)
+            right = values[match.group(3)]
+            return left + right if match.group(2) == '+' else left - right
+        if expression in values:
+            return values[expression]
+        raise NotImplementedError(f"Update expression not supported by FakeTable: {expression}")
+
+
+class FakeDynamoDBClient:
+    """Low-level DynamoDB client stand-in for transactions and batch calls over FakeTables.
+
+    Setting throttled_batches makes that many upcoming batch calls process
+    only the first half of their requests, returning the rest as unprocessed.
+    """
+
+    def __init__(self, tables, latency=0.0):
+        self.tables = {table.name: table for table in tables}
+        self.latency = latency
+        self.throttled_batches = 0
+        self.batch_calls = 0
+
+    def _throttle(self, requests):
+        """Split requests into (processed, unprocessed) for the current batch call"""
+        self.batch_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttled_batches > 0 and len(requests) > 1:
+            self.throttled_batches -= 1
+            half = len(requests) // 2
+            return requests[:half], requests[half:]
+        return requests, []
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+        unprocessed_items = {}
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise _client_error('ValidationException', 'BatchWriteItem')
+            table = self.tables[table_name]
+            processed, unprocessed = self._throttle(requests)
+            with table._lock:
+                for request in processed:
+                    item = {name: deserializer.deserialize(value)
+                            for name, value in request['PutRequest']['Item'].items()}
+                    table.items[item[table.key_name]] = item
+            if unprocessed:
+                unprocessed_items[table_name] = unprocessed
+        return {'UnprocessedItems': unprocessed_items}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        serializer, deserializer = TypeSerializer(), TypeDeserializer()
+        responses, unprocessed_keys = {}, {}
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise _client_error('ValidationException', 'BatchGetItem')
+            table = self.tables[table_name]
+            processed, unprocessed = self._throttle(request['Keys'])
+            wanted = None
+            if request.get('ProjectionExpression'):
+                wanted = {token.strip() for token in request['ProjectionExpression'].split(',')}
+            found = []
+            with table._lock:
+                for key in processed:
+                    item = table.items.get(deserializer.deserialize(key[table.key_name]))
+                    if item is not None:
+                        found.append({name: serializer.serialize(value) for name, value in item.items()
+                                      if wanted is None or name in wanted})
+            responses[table_name] = found
+            if unprocessed:
+                unprocessed_keys[table_name] = dict(request, Keys=unprocessed)
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed_keys}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+
+        def plain(attributes):
+            return {name: deserializer.deserialize(value) for name, value in (attributes or {}).items()}
+
+        if self.latency:
+            time.sleep(self.latency)
+        actions = []
+        for entry in TransactItems:
+            (action, request), = entry.items()
+            table = self.tables[request['TableName']]
+            key = plain(request['Key'])[table.key_name] if 'Key' in request else plain(request['Item'])[table.key_name]
+            actions.append((action, request, table, key))
+
+        locks = sorted({table.name: table._lock for _, _, table, _ in actions}.items())
+        for _, lock in locks:
+            lock.acquire()
+        try:
+            reasons = []
+            for action, request, table, key in actions:
+                ok = table._check(table.items.get(key), request.get('ConditionExpression'),
+                                  request.get('ExpressionAttributeNames') or {},
+                                  plain(request.get('ExpressionAttributeValues')))
+                reasons.append({'Code': 'None' if ok else 'ConditionalCheckFailed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'cancelled'},
+                                   'CancellationReasons': reasons}, 'TransactWriteItems')
+            for action, request, table, key in actions:
+                if action == 'Put':
+                    table.items[key] = plain(request['Item'])
+                elif action == 'Delete':
+                    table.items.pop(key, None)
+                else:
+                    raise NotImplementedError(f"Transaction action not supported by FakeDynamoDBClient: {action}")
+        finally:
+            for _, lock in reversed(locks):
+                lock.release()
+        return {}
+
+
+class FakeSNS:
+    """SNS client stand-in that records published messages"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.published = 0
+        self.last_message = None
+        self.last_attributes = None
+
+    def publish(self, TopicArn, Message, Subject=None, MessageAttributes=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        self.published += 1
+        self.last_message = (Subject, Message)
+        self.last_attributes = MessageAttributes
+        return {'MessageId': str(self.published)}
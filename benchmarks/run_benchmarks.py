@@ -0,0 +1,519 @@
+"""Load test and micro-benchmarks for app.py using in-process AWS stand-ins.
+
+The load test drives the real Flask routes through the test client from
+several threads, with DynamoDB and SNS replaced by the fakes in
+benchmarks/fakes.py (each call can be given a latency to mimic AWS).
+The micro-benchmarks time the catalog, cart and notification helpers.
+
+Usage (from the repository root):
+
+    python benchmarks/run_benchmarks.py --users 8 --duration 10 --output results.json
+    python benchmarks/run_benchmarks.py --output new.json --compare results.json
+
+Results are written as JSON so runs from different commits can be diffed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from decimal import Decimal
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(REPO_ROOT)
+os.environ.setdefault('STORAGE_BACKEND', 'dynamodb')
+# Virtual users loop far faster than people click; the load test measures throughput, not the rate limits
+for limit in ('RATE_LIMIT_POLL_RATE', 'RATE_LIMIT_MUTATION_RATE', 'RATE_LIMIT_GLOBAL_RATE'):
+    os.environ.setdefault(limit, '0')
+
+import logging  # noqa: E402
+
+import jinja2  # noqa: E402
+
+import app as bookbazar  # noqa: E402
+import catalog_format  # noqa: E402
+from fakes import FakeDynamoDBClient, FakeSNS, FakeTable  # noqa: E402
+
+CHECKOUT_FORM = {
+    'name': 'Bench User',
+    'email': 'bench@example.com',
+    'address': '1 Benchmark Road',
+    'payment_method': 'credit_card'
+}
+
+# Templates referenced by routes but not present in templates/
+FALLBACK_TEMPLATES = {
+    'confirmation.html': 'Order confirmed: {{ order_total }}',
+}
+
+
+def install_fakes(db_latency, sns_latency):
+    """Point the app's storage and SNS client at in-process fakes"""
+    users_table = FakeTable(latency=db_latency, name='users')
+    carts_table = FakeTable(latency=db_latency, name='carts')
+    orders_table = FakeTable(key_name='order_id', latency=db_latency, name='orders')
+    client = FakeDynamoDBClient([users_table, carts_table, orders_table], latency=db_latency)
+    sns = FakeSNS(latency=sns_latency)
+    bookbazar.storage = bookbazar.DynamoDBStorage(users_table, carts_table, orders_table, client)
+    bookbazar.aws.set_client('sns', sns)
+    bookbazar.app.jinja_loader = jinja2.ChoiceLoader([
+        bookbazar.app.jinja_loader,
+        jinja2.DictLoader(FALLBACK_TEMPLATES),
+    ])
+    return users_table, carts_table, sns
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def run_user(user_index, deadline, book_ids, seed, results, errors):
+    """Log in and loop through the shopping scenario until the deadline"""
+    client = bookbazar.app.test_client()
+    rng = random.Random(seed + user_index)
+    username = f'bench-user-{user_index}'
+    password = 'bench-password'
+    bookbazar.create_user_in_db(username, password)
+
+    def timed(label, method, path, **kwargs):
+        started = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        results.setdefault(label, []).append(time.perf_counter() - started)
+        if response.status_code >= 500:
+            errors.append(f'{label} -> {response.status_code}')
+        return response
+
+    timed('/login', 'post', '/login', data={'username': username, 'password': password})
+    while time.perf_counter() < deadline:
+        book_id = rng.choice(book_ids)
+        timed('/books', 'get', '/books')
+        timed('/add_to_cart/<id>', 'get', f'/add_to_cart/{book_id}')
+        timed('/api/cart_count', 'get', '/api/cart_count')
+        timed('/api/book/<id>', 'get', f'/api/book/{book_id}')
+        timed('/api/add-to-cart', 'post', '/api/add-to-cart', json={'book_id': book_id})
+        timed('/api/cart/batch', 'post', '/api/cart/batch', json={'operations': [
+            {'op': 'add', 'book_id': rng.choice(book_ids), 'quantity': 2},
+            {'op': 'set', 'book_id': book_id, 'quantity': 1},
+        ]})
+        timed('/update_cart/<id>/<action>', 'get', f'/update_cart/{book_id}/increase')
+        timed('/checkout', 'get', '/checkout')
+        timed('/process_checkout', 'post', '/process_checkout', data=CHECKOUT_FORM)
+
+
+def run_load_test(users, duration, seed):
+    book_ids = [book['id'] for book in bookbazar.catalog.all_books()]
+    per_user = [{} for _ in range(users)]
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=run_user, args=(index, deadline, book_ids, seed, per_user[index], errors))
+        for index in range(users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    merged = {}
+    for results in per_user:
+        for label, latencies in results.items():
+            merged.setdefault(label, []).extend(latencies)
+    all_latencies = [value for latencies in merged.values() for value in latencies]
+    overall = summarize(all_latencies)
+    overall['rps'] = round(len(all_latencies) / elapsed, 1)
+    overall['errors'] = len(errors)
+    routes = {}
+    for label, latencies in sorted(merged.items()):
+        routes[label] = summarize(latencies)
+        routes[label]['rps'] = round(len(latencies) / elapsed, 1)
+    return {'overall': overall, 'routes': routes, 'error_samples': errors[:10]}
+
+
+def time_call(func, min_time=0.2):
+    """Return (ns per call, calls) for func, repeating until min_time has elapsed"""
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls * 1e9, calls
+        calls = max(calls * 2, int(calls * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def sample_cart(size):
+    """Hydrated cart items for the notification builders"""
+    books = bookbazar.catalog.all_books()
+    return [dict(books[index % len(books)], quantity=1 + index % 3) for index in range(size)]
+
+
+def sample_dynamodb_cart(size):
+    """A legacy cart document as returned by DynamoDB (Decimal numbers, full book copies)"""
+    return json.loads(json.dumps(sample_cart(size)), parse_float=Decimal, parse_int=Decimal)
+
+
+def legacy_decimal_to_float(obj):
+    """The recursive Decimal conversion carts used before the cart codec"""
+    if isinstance(obj, list):
+        return [legacy_decimal_to_float(item) for item in obj]
+    elif isinstance(obj, dict):
+        return {key: legacy_decimal_to_float(value) for key, value in obj.items()}
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    return obj
+
+
+def legacy_cart_round_trip(cart_items):
+    """Store and load a cart the old way: JSON round trip to Decimals on write, full conversion on read"""
+    stored = json.loads(json.dumps(cart_items), parse_float=Decimal)
+    return legacy_decimal_to_float(stored)
+
+
+def codec_cart_round_trip(lines):
+    """Store and load a cart through the cart codec and hydrate it from the catalog"""
+    stored = bookbazar.encode_cart_lines(lines)
+    return bookbazar.hydrate_cart(bookbazar.cart_lines_from_item(stored))
+
+
+def run_micro_benchmarks(min_time):
+    book_ids = [book['id'] for book in bookbazar.catalog.all_books()]
+    customer = dict(CHECKOUT_FORM)
+    benchmarks = {
+        'load_books': lambda: bookbazar.load_books(),
+        'find_book_by_id': lambda: bookbazar.find_book_by_id(book_ids[len(book_ids) // 2]),
+        'hydrate_cart[whole catalog]': lambda: bookbazar.hydrate_cart({book_id: 2 for book_id in book_ids}),
+    }
+    for size in (1, 50, 500):
+        cart_items = sample_cart(size)
+        benchmarks[f'build_cart_update_notification[{size} items]'] = \
+            lambda items=cart_items: bookbazar.build_cart_update_notification('bench', items)
+        benchmarks[f'build_order_confirmation_notification[{size} items]'] = \
+            lambda items=cart_items: bookbazar.build_order_confirmation_notification('bench', items, customer, 100.0)
+    for size in (50, 500):
+        cart_items = sample_cart(size)
+        dynamodb_cart = sample_dynamodb_cart(size)
+        lines = {}
+        for item in cart_items:
+            lines[item['id']] = lines.get(item['id'], 0) + item['quantity']
+        benchmarks[f'cart_round_trip_legacy[{size} items]'] = lambda items=cart_items: legacy_cart_round_trip(items)
+        benchmarks[f'cart_round_trip_codec[{size} items]'] = lambda lines=lines: codec_cart_round_trip(lines)
+        benchmarks[f'legacy_cart_lines[{size} items]'] = \
+            lambda items=dynamodb_cart: bookbazar.legacy_cart_lines(items)
+    results = {}
+    for name, func in benchmarks.items():
+        ns_per_op, calls = time_call(func, min_time)
+        results[name] = {
+            'ns_per_op': round(ns_per_op, 1),
+            'ops_per_sec': round(1e9 / ns_per_op, 1),
+            'calls': calls,
+        }
+    return results
+
+
+def run_password_benchmark(duration, threads):
+    """Single-thread verify cost (logins/sec per core) and a login storm through the bounded hasher pool"""
+    hasher = bookbazar.password_hasher
+    stored = hasher.hash('bench-password')
+    ns_per_op, calls = time_call(lambda: hasher.verify('bench-password', stored), min_time=min(duration, 1.0))
+
+    counts = {'ok': 0, 'rejected': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def storm():
+        while time.perf_counter() < deadline:
+            try:
+                hasher.verify('bench-password', stored)
+                outcome = 'ok'
+            except bookbazar.PasswordHasherBusy:
+                outcome = 'rejected'
+                time.sleep(0.001)
+            with lock:
+                counts[outcome] += 1
+
+    workers = [threading.Thread(target=storm) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'algorithm': hasher.algorithm,
+        'params': list(hasher._params()),
+        'verify_ms': round(ns_per_op / 1e6, 3),
+        'logins_per_sec_per_core': round(1e9 / ns_per_op, 1),
+        'storm': {
+            'threads': threads,
+            'pool_workers': hasher.workers,
+            'max_pending': hasher.max_pending,
+            'logins_per_sec': round(counts['ok'] / elapsed, 1),
+            'rejected_per_sec': round(counts['rejected'] / elapsed, 1),
+        },
+    }
+
+
+def run_compact_catalog_benchmark(size, seed):
+    """Per-worker cost of a BookCatalog over a synthetic books.json vs over the same books compiled and mapped"""
+    rng = random.Random(seed)
+    books = [{
+        'id': book_id,
+        'title': f'Synthetic Title {book_id}',
+        'author': f'Author {rng.randrange(size // 10 + 1)}',
+        'genre': rng.choice(['Fantasy', 'Classic Fiction', 'Science Fiction', 'History', 'Memoir']),
+        'year': rng.randint(1800, 2024),
+        'price': round(rng.uniform(2, 60), 2),
+        'description': 'A synthetic book description used to size the catalog benchmark. ' * 2,
+        'image': f'static/images/synthetic-{book_id}.jpeg',
+    } for book_id in range(1, size + 1)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'books.json')
+        compact_path = os.path.join(directory, 'books.bbcat')
+        with open(json_path, 'w') as f:
+            json.dump(books, f)
+        del books
+        started = time.perf_counter()
+        catalog_format.compile_catalog(catalog_format.iter_books(json_path), compact_path)
+        compile_s = time.perf_counter() - started
+
+        # Prebuilt (empty) related-books tables, as `flask build-related` leaves them, so neither
+        # catalog starts a background build while its heap is measured
+        related_paths = {}
+        for path in (json_path, compact_path):
+            related_paths[path] = f'{path}.related.json'
+            with open(related_paths[path], 'w') as f:
+                json.dump({'books_digest': bookbazar.file_digest(path), 'related': {}}, f)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        json_catalog = bookbazar.BookCatalog(json_path, related_path=related_paths[json_path])
+        json_load_ms = (time.perf_counter() - started) * 1e3
+        json_heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del json_catalog
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        compact_catalog = bookbazar.BookCatalog(compact_path, related_path=related_paths[compact_path])
+        open_ms = (time.perf_counter() - started) * 1e3
+        compact_heap = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        compact_catalog.page(sort='title')
+        first_page_ms = (time.perf_counter() - started) * 1e3
+        listing_heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        compact = compact_catalog.compact
+        lookup_ids = [rng.randint(1, size) for _ in range(1000)]
+        get_ns, _ = time_call(lambda: [compact_catalog.get(book_id) for book_id in lookup_ids])
+        page_ns, _ = time_call(lambda: compact_catalog.page(sort='title', page=size // 40))
+        filter_ns, _ = time_call(lambda: compact.filter_ids(price_min_cents=1000, price_max_cents=2000,
+                                                            year_min=1950, year_max=2000))
+        result = {
+            'books': size,
+            'json_bytes': os.path.getsize(json_path),
+            'compact_bytes': os.path.getsize(compact_path),
+            'compile_s': round(compile_s, 3),
+            'json_load_ms': round(json_load_ms, 1),
+            'json_heap_mb': round(json_heap / 2 ** 20, 1),
+            'compact_open_ms': round(open_ms, 3),
+            'compact_heap_kb': round(compact_heap / 2 ** 10, 1),
+            'compact_first_page_ms': round(first_page_ms, 1),
+            'compact_listing_heap_kb': round(listing_heap / 2 ** 10, 1),
+            'compact_get_us': round(get_ns / len(lookup_ids) / 1e3, 2),
+            'compact_page_us': round(page_ns / 1e3, 1),
+            'compact_filter_ms': round(filter_ns / 1e6, 2),
+            'filter_engine': 'numpy' if catalog_format.np is not None else 'python',
+        }
+    return result
+
+
+def synthetic_catalog(size, seed):
+    """Books with Zipf-distributed description words, for index build benchmarks"""
+    rng = random.Random(seed)
+    vocabulary = [f'word{index}' for index in range(max(2000, size // 5))]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    genres = [f'genre {index}' for index in range(30)]
+    books = []
+    for book_id in range(1, size + 1):
+        words = rng.choices(vocabulary, weights, k=40)
+        books.append({
+            'id': book_id,
+            'title': ' '.join(words[:3]),
+            'author': f'author {rng.randrange(max(1, size // 8))}',
+            'genre': rng.choice(genres),
+            'year': rng.randint(1800, 2024),
+            'price': round(rng.uniform(2, 60), 2),
+            'description': ' '.join(words),
+        })
+    return books
+
+
+def run_related_benchmark(sizes, seed):
+    """Related-books table rebuild time and per-request lookup cost as the catalog grows"""
+    results = {}
+    for size in sizes:
+        books = synthetic_catalog(size, seed)
+        started = time.perf_counter()
+        related = bookbazar.build_related_books(books)
+        build_s = time.perf_counter() - started
+        lookup_ids = [random.Random(seed).randint(1, size) for _ in range(1000)]
+        lookup_ns, _ = time_call(lambda: [related.get(book_id) for book_id in lookup_ids])
+        results[str(size)] = {
+            'build_s': round(build_s, 3),
+            'books_per_sec': round(size / build_s, 1),
+            'lookup_ns': round(lookup_ns / len(lookup_ids), 1),
+            'avg_related': round(sum(len(ids) for ids in related.values()) / size, 2),
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=REPO_ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percent_change(old, new):
+    if not old:
+        return 'n/a'
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def print_report(results, baseline=None):
+    load = results.get('load_test')
+    if load:
+        overall = load['overall']
+        print(f"\nLoad test: {overall['requests']} requests, {overall['rps']} req/s, "
+              f"p50 {overall['p50_ms']} ms, p99 {overall['p99_ms']} ms, errors {overall['errors']}")
+        old_routes = (baseline or {}).get('load_test', {}).get('routes', {})
+        print(f"{'route':32} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  {'p50 vs baseline':>16}")
+        for label, stats in load['routes'].items():
+            delta = percent_change(old_routes[label]['p50_ms'], stats['p50_ms']) if label in old_routes else ''
+            print(f"{label:32} {stats['rps']:>9} {stats['p50_ms']:>9} {stats['p99_ms']:>9}  {delta:>16}")
+
+    password = results.get('password')
+    if password:
+        storm = password['storm']
+        print(f"\nPassword hashing ({password['algorithm']} {password['params']}): "
+              f"{password['verify_ms']} ms per verify, {password['logins_per_sec_per_core']} logins/s per core; "
+              f"storm of {storm['threads']} threads on {storm['pool_workers']} workers: "
+              f"{storm['logins_per_sec']} logins/s, {storm['rejected_per_sec']} rejected/s")
+
+    compact = results.get('compact_catalog')
+    if compact:
+        print(f"\nCompact catalog ({compact['books']} books): JSON {compact['json_bytes'] / 2 ** 20:.1f} MiB loads in "
+              f"{compact['json_load_ms']} ms into {compact['json_heap_mb']} MiB of heap per worker; compact file "
+              f"{compact['compact_bytes'] / 2 ** 20:.1f} MiB maps in {compact['compact_open_ms']} ms with "
+              f"{compact['compact_heap_kb']} KiB of heap ({compact['compact_listing_heap_kb']} KiB once the first "
+              f"title listing sorts its rows in {compact['compact_first_page_ms']} ms), "
+              f"{compact['compact_get_us']} us per lookup, {compact['compact_page_us']} us per listing page, "
+              f"{compact['compact_filter_ms']} ms per price/year filter ({compact['filter_engine']})")
+
+    related = results.get('related_books')
+    if related:
+        old_related = (baseline or {}).get('related_books', {})
+        print(f"\n{'related books build':20} {'seconds':>9} {'books/s':>10} {'lookup ns':>10}  {'vs baseline':>12}")
+        for size, stats in related.items():
+            delta = percent_change(old_related[size]['build_s'], stats['build_s']) if size in old_related else ''
+            print(f"{size + ' books':20} {stats['build_s']:>9} {stats['books_per_sec']:>10} "
+                  f"{stats['lookup_ns']:>10}  {delta:>12}")
+
+    micro = results.get('micro')
+    if micro:
+        old_micro = (baseline or {}).get('micro', {})
+        print(f"\n{'micro-benchmark':50} {'ns/op':>12} {'ops/s':>12}  {'vs baseline':>12}")
+        for name, stats in micro.items():
+            delta = percent_change(old_micro[name]['ns_per_op'], stats['ns_per_op']) if name in old_micro else ''
+            print(f"{name:50} {stats['ns_per_op']:>12} {stats['ops_per_sec']:>12}  {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users (threads)')
+    parser.add_argument('--duration', type=float, default=10.0, help='load test duration in seconds')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='seconds added to every DynamoDB call')
+    parser.add_argument('--sns-latency', type=float, default=0.0, help='seconds added to every SNS publish')
+    parser.add_argument('--micro-time', type=float, default=0.2, help='minimum seconds per micro-benchmark')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-load', action='store_true', help='only run the micro-benchmarks')
+    parser.add_argument('--skip-micro', action='store_true', help='only run the load test')
+    parser.add_argument('--password-time', type=float, default=3.0,
+                        help='seconds for the password hashing login storm (0 to skip)')
+    parser.add_argument('--password-threads', type=int, default=64, help='threads in the login storm')
+    parser.add_argument('--compact-books', type=int, default=100000,
+                        help='synthetic catalog size for the compact catalog benchmark (0 to skip)')
+    parser.add_argument('--related-sizes', type=int, nargs='*', default=[1000, 10000, 100000],
+                        help='catalog sizes for the related-books rebuild benchmark (none to skip)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    install_fakes(args.db_latency, args.sns_latency)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage_backend': 'dynamodb (fake)',
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        }
+    }
+    if not args.skip_micro:
+        results['micro'] = run_micro_benchmarks(args.micro_time)
+    if args.password_time > 0:
+        results['password'] = run_password_benchmark(args.password_time, args.password_threads)
+    if args.compact_books > 0:
+        results['compact_catalog'] = run_compact_catalog_benchmark(args.compact_books, args.seed)
+    if args.related_sizes:
+        results['related_books'] = run_related_benchmark(args.related_sizes, args.seed)
+    if not args.skip_load:
+        results['load_test'] = run_load_test(args.users, args.duration, args.seed)
+    bookbazar.notifier.shutdown()
+    bookbazar.order_outbox.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
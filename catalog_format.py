@@ -0,0 +1,279 @@
+"""Compact binary catalog format, read through a shared read-only mmap.
+
+tools/compile_catalog.py turns books.json (or a JSONL export streamed one
+book per line) into a single file that every worker process maps
+read-only, so the operating system keeps one copy of the catalog in the
+page cache however many workers there are. Layout (little-endian, every
+section 8-byte aligned):
+
+    header          magic, version, string field count, row count and
+                    the offset of each section below
+    ids             int64[rows], ascending: the id index, binary searched
+    price_cents     int64[rows]
+    years           int32[rows], MISSING_YEAR when a book has no year
+    string offsets  uint64[rows * fields] into the string table
+    string lengths  uint32[rows * fields], MISSING_STRING for no value
+    strings         UTF-8 bytes of every title/author/genre/description/image
+
+Lookups slice the mapping without copying until a field is decoded, and
+price/year range filters run over the fixed-width columns, vectorized
+with NumPy when it is installed.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'BBCATLG\x00'
+VERSION = 1
+STRING_FIELDS = ('title', 'author', 'genre', 'description', 'image')
+MISSING_YEAR = -2 ** 31
+MISSING_STRING = 2 ** 32 - 1
+
+# magic, version, field count, reserved, rows, then the offsets of ids, price_cents,
+# years, string offsets, string lengths and strings, and the size of the strings section
+HEADER = struct.Struct('<8sHHIQ7Q')
+
+
+class CatalogFormatError(ValueError):
+    """The file is not a compact catalog this reader understands"""
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _price_cents(price):
+    return int(round(Decimal(str(price)) * 100))
+
+
+def iter_books(path):
+    """Yield books from a JSON array file, or one per line from a .jsonl export"""
+    with open(path, 'r') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def compile_catalog(books, output_path):
+    """Write books (any iterable of dicts) to output_path in the compact format; returns the row count.
+
+    Strings are spooled to a temporary file as the books stream in, so only
+    the fixed-width columns are held in memory while compiling.
+    """
+    ids, prices, years = array('q'), array('q'), array('i')
+    string_offsets, string_lengths = array('Q'), array('I')
+    directory = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        spooled = 0
+        for book in books:
+            ids.append(int(book['id']))
+            prices.append(_price_cents(book.get('price', 0)))
+            year = book.get('year')
+            years.append(MISSING_YEAR if year is None else int(year))
+            for field in STRING_FIELDS:
+                value = book.get(field)
+                if value is None:
+                    string_offsets.append(0)
+                    string_lengths.append(MISSING_STRING)
+                    continue
+                data = str(value).encode('utf-8')
+                spool.write(data)
+                string_offsets.append(spooled)
+                string_lengths.append(len(data))
+                spooled += len(data)
+
+        rows, fields = len(ids), len(STRING_FIELDS)
+        order = sorted(range(rows), key=ids.__getitem__)
+        for previous, current in zip(order, order[1:]):
+            if ids[previous] == ids[current]:
+                raise ValueError(f"Duplicate book id {ids[current]}")
+
+        # Columns are written in id order; string references keep pointing into the spool order
+        columns = [
+            array('q', (ids[row] for row in order)),
+            array('q', (prices[row] for row in order)),
+            array('i', (years[row] for row in order)),
+            array('Q', (string_offsets[row * fields + field] for row in order for field in range(fields))),
+            array('I', (string_lengths[row * fields + field] for row in order for field in range(fields))),
+        ]
+        for column in columns:
+            if sys.byteorder != 'little':
+                column.byteswap()
+
+        offsets, position = [], _align(HEADER.size)
+        for column in columns:
+            offsets.append(position)
+            position = _align(position + len(column) * column.itemsize)
+        strings_offset = position
+
+        temporary_path = f"{output_path}.tmp"
+        with open(temporary_path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, fields, 0, rows, *offsets, strings_offset, spooled))
+            for offset, column in zip(offsets, columns):
+                out.write(b'\0' * (offset - out.tell()))
+                column.tofile(out)
+            out.write(b'\0' * (strings_offset - out.tell()))
+            spool.seek(0)
+            while True:
+                chunk = spool.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+        # Workers may be mapping the old file; replacing it leaves their mapping intact
+        os.replace(temporary_path, output_path)
+    return rows
+
+
+def is_compact_catalog(path):
+    """True if the file starts with the compact catalog magic"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class CompactCatalog:
+    """Read-only, mmap-backed view of a compiled catalog file"""
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise CatalogFormatError("Compact catalogs can only be mapped on little-endian hosts")
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = HEADER.unpack_from(self._mmap, 0)
+        except struct.error:
+            self._mmap.close()
+            raise CatalogFormatError(f"{path} is too short to be a compact catalog")
+        magic, version, fields, _, rows, *offsets, strings_size = header
+        if magic != MAGIC or version != VERSION or fields != len(STRING_FIELDS):
+            self._mmap.close()
+            raise CatalogFormatError(f"{path} is not a version {VERSION} compact catalog")
+
+        self.rows = rows
+        self._fields = fields
+        self._offsets = offsets
+        view = memoryview(self._mmap)
+        ids_at, prices_at, years_at, string_offsets_at, string_lengths_at, strings_at = offsets
+        self.ids = view[ids_at:ids_at + rows * 8].cast('q')
+        self.price_cents = view[prices_at:prices_at + rows * 8].cast('q')
+        self.years = view[years_at:years_at + rows * 4].cast('i')
+        self._string_offsets = view[string_offsets_at:string_offsets_at + rows * fields * 8].cast('Q')
+        self._string_lengths = view[string_lengths_at:string_lengths_at + rows * fields * 4].cast('I')
+        self._strings = view[strings_at:strings_at + strings_size]
+        self._view = view
+        self._arrays = None
+
+    def __len__(self):
+        return self.rows
+
+    def row_of(self, book_id):
+        """Return the row holding book_id, or None"""
+        row = bisect.bisect_left(self.ids, book_id)
+        if row < self.rows and self.ids[row] == book_id:
+            return row
+        return None
+
+    def field_bytes(self, row, field):
+        """Zero-copy view of a string field's UTF-8 bytes, or None if the book has no value"""
+        index = row * self._fields + STRING_FIELDS.index(field)
+        length = self._string_lengths[index]
+        if length == MISSING_STRING:
+            return None
+        start = self._string_offsets[index]
+        return self._strings[start:start + length]
+
+    def book_at(self, row):
+        """Decode the book stored at row into a dict shaped like a books.json entry"""
+        book = {'id': self.ids[row], 'price': self.price_cents[row] / 100}
+        year = self.years[row]
+        if year != MISSING_YEAR:
+            book['year'] = year
+        for field in STRING_FIELDS:
+            value = self.field_bytes(row, field)
+            if value is not None:
+                book[field] = str(value, 'utf-8')
+        return book
+
+    def get(self, book_id):
+        """Return the book with the given id, or None"""
+        row = self.row_of(book_id)
+        return None if row is None else self.book_at(row)
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self.book_at(row)
+
+    def _numpy_columns(self):
+        """(ids, price_cents, years) as NumPy arrays over the mapping, created once"""
+        if self._arrays is None:
+            ids_at, prices_at, years_at = self._offsets[:3]
+            self._arrays = (
+                np.frombuffer(self._mmap, dtype='<i8', count=self.rows, offset=ids_at),
+                np.frombuffer(self._mmap, dtype='<i8', count=self.rows, offset=prices_at),
+                np.frombuffer(self._mmap, dtype='<i4', count=self.rows, offset=years_at),
+            )
+        return self._arrays
+
+    def filter_ids(self, price_min_cents=None, price_max_cents=None, year_min=None, year_max=None):
+        """Ids of the books within the given price (in cents) and year ranges, ascending"""
+        if np is not None:
+            ids, prices, years = self._numpy_columns()
+            mask = np.ones(self.rows, dtype=bool)
+            if price_min_cents is not None:
+                mask &= prices >= price_min_cents
+            if price_max_cents is not None:
+                mask &= prices <= price_max_cents
+            if year_min is not None or year_max is not None:
+                mask &= years != MISSING_YEAR
+                if year_min is not None:
+                    mask &= years >= year_min
+                if year_max is not None:
+                    mask &= years <= year_max
+            return ids[mask].tolist()
+
+        result = []
+        ids, prices, years = self.ids, self.price_cents, self.years
+        check_year = year_min is not None or year_max is not None
+        for row in range(self.rows):
+            price = prices[row]
+            if price_min_cents is not None and price < price_min_cents:
+                continue
+            if price_max_cents is not None and price > price_max_cents:
+                continue
+            if check_year:
+                year = years[row]
+                if year == MISSING_YEAR or (year_min is not None and year < year_min) \
+                        or (year_max is not None and year > year_max):
+                    continue
+            result.append(ids[row])
+        return result
+
+    def close(self):
+        """Release the mapping; views and arrays handed out earlier must no longer be used"""
+        self._arrays = None
+        for name in ('ids', 'price_cents', 'years', '_string_offsets', '_string_lengths', '_strings', '_view'):
+            getattr(self, name).release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
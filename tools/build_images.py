@@ -0,0 +1,165 @@
+"""Build content-hashed, resized cover images for the book listing.
+
+Reads every image under static/images and writes into static/build:
+
+- a copy of each original under a content-hashed name, and
+- with Pillow installed, JPEG and WebP thumbnails at each of --widths,
+
+plus manifest.json, which maps 'images/<file>' to those files. The catalog
+resolves cover paths against the manifest, and app.py serves everything
+under static/build with a far-future Cache-Control since a file's name
+changes whenever its content does. Without Pillow only the hashed copies
+are written and the listing falls back to the single original.
+
+Usage (from the repository root):
+
+    pip install Pillow   # optional, for thumbnails and WebP
+    python tools/build_images.py --widths 200 400 600
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(REPO_ROOT, 'static')
+SOURCE_DIR = os.path.join(STATIC_DIR, 'images')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+
+OUTPUT_FORMATS = [
+    # (Pillow format, file extension, MIME type, save options)
+    ('JPEG', 'jpg', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+    ('WEBP', 'webp', 'image/webp', {'quality': 78, 'method': 6}),
+]
+
+
+def slugify(name):
+    """Lower-case, URL-safe stem for output files (covers have spaces in their names)"""
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'image'
+
+
+def hashed_name(stem, data, extension):
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}.{extension}"
+
+
+def write_asset(relative_path, data, written):
+    """Write a build file unless an identical one (same hashed name) is already there"""
+    path = os.path.join(STATIC_DIR, relative_path)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    written.add(os.path.normpath(path))
+    return len(data)
+
+
+def flatten(image):
+    """Return an RGB copy of the image, with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def build_variants(source, stem, widths, written):
+    """Encode JPEG and WebP thumbnails of the source at each width not larger than the original"""
+    with Image.open(source) as opened:
+        image = flatten(opened)
+    original_width, original_height = image.size
+    targets = [width for width in sorted(set(widths)) if width < original_width] or [original_width]
+    variants, output_bytes = [], 0
+    for width in targets:
+        height = max(1, round(original_height * width / original_width))
+        resized = image if width == original_width else image.resize((width, height), Image.LANCZOS)
+        for image_format, extension, mime_type, options in OUTPUT_FORMATS:
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format, **options)
+            data = buffer.getvalue()
+            path = f"build/images/{hashed_name(f'{stem}-{width}', data, extension)}"
+            output_bytes += write_asset(path, data, written)
+            variants.append({'path': path, 'width': width, 'height': height, 'type': mime_type})
+    return {'width': original_width, 'height': original_height, 'variants': variants}, output_bytes
+
+
+def build(widths, prune=True):
+    """Build every source image and write the manifest; returns the manifest"""
+    manifest, written = {}, set()
+    source_bytes = output_bytes = 0
+    for directory, _, files in os.walk(SOURCE_DIR):
+        for filename in sorted(files):
+            stem, extension = os.path.splitext(filename)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            source = os.path.join(directory, filename)
+            key = os.path.relpath(source, STATIC_DIR).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            source_bytes += len(data)
+
+            original = f"build/images/{hashed_name(slugify(stem), data, extension.lower().lstrip('.'))}"
+            write_asset(original, data, written)
+            entry = {'original': original, 'src': original, 'variants': []}
+            if Image is not None:
+                try:
+                    details, size = build_variants(source, slugify(stem), widths, written)
+                except (OSError, ValueError) as e:
+                    print(f"  {key}: could not resize ({e}), using the original only", file=sys.stderr)
+                else:
+                    entry.update(details)
+                    output_bytes += size
+                    jpeg = [variant for variant in entry['variants'] if variant['type'] == 'image/jpeg']
+                    if jpeg:
+                        # Browsers without srcset support get the largest thumbnail, not the original
+                        entry['src'] = jpeg[-1]['path']
+            manifest[key] = entry
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest_path = os.path.join(BUILD_DIR, 'manifest.json')
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    # The app reloads the catalog when the manifest changes, so never expose a partial file
+    os.replace(temporary_path, manifest_path)
+    written.add(os.path.normpath(manifest_path))
+
+    removed = 0
+    if prune:
+        for directory, _, files in os.walk(BUILD_DIR):
+            for filename in files:
+                path = os.path.normpath(os.path.join(directory, filename))
+                if path not in written:
+                    os.remove(path)
+                    removed += 1
+
+    print(f"Built {len(manifest)} images into {os.path.relpath(BUILD_DIR, REPO_ROOT)}"
+          f" ({removed} stale files removed)")
+    if Image is None:
+        print("Pillow is not installed: wrote hashed copies only (pip install Pillow for thumbnails and WebP)")
+    else:
+        print(f"Source images: {source_bytes / 1024:.0f} KiB, thumbnails: {output_bytes / 1024:.0f} KiB")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--widths', type=int, nargs='+', default=[200, 400, 600],
+                        help='thumbnail widths in pixels (default: 200 400 600)')
+    parser.add_argument('--keep-stale', action='store_true',
+                        help='keep build files no longer referenced by the manifest')
+    args = parser.parse_args()
+    build(args.widths, prune=not args.keep_stale)
+
+
+if __name__ == '__main__':
+    main()
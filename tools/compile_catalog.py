@@ -0,0 +1,40 @@
+"""Compile books.json (or a JSONL export) into the compact mmap catalog format.
+
+See catalog_format.py for the layout. Point the app at the compiled file
+with BOOKS_PATH; every worker then maps it read-only instead of parsing
+JSON into its own copy.
+
+Usage (from the repository root):
+
+    python tools/compile_catalog.py data/books.json data/books.bbcat
+    python tools/compile_catalog.py export.jsonl data/books.bbcat
+    BOOKS_PATH=data/books.bbcat python asgi.py
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from catalog_format import CompactCatalog, compile_catalog, iter_books  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='books.json array or .jsonl file with one book per line')
+    parser.add_argument('output', help='compact catalog file to write')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = compile_catalog(iter_books(args.source), args.output)
+    elapsed = time.perf_counter() - started
+    with CompactCatalog(args.output) as compiled:
+        assert len(compiled) == rows
+    print(f"Compiled {rows} books into {args.output} ({os.path.getsize(args.output) / 1024:.0f} KiB) "
+          f"in {elapsed:.2f}s; source was {os.path.getsize(args.source) / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()